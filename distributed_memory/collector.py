@@ -1,25 +1,115 @@
 """This module implements a `Collector` which host a subset of the distributed
 memory."""
 
+import array
+import bisect
+import collections
+import heapq
+import itertools
+import os
+import sys
 import time
 import logging
+import zlib
 
 from mpi4py import MPI
+from mpi4py.util import pkl5
 import dill
 
 from .tags import Tags
 from .logger import log
+from .metrics import Metrics
+from .serializer import Serializer, COMPRESSION_THRESHOLD
+
+
+# Type of the integers in the files written by `save` and read by `load`.
+FILE_TYPECODE = 'q'
+
+# A handle is an `int`: the slave's rank in its lowest bits, then a flag set
+# for the integers stored in the slab, then the chunk's counter or the slot and
+# its generation. The generation of a slot changes once freed: its previous
+# handles are stale, until it wraps around.
+RANK_BITS = 20
+RANK_MASK = (1 << RANK_BITS) - 1
+SCALAR_FLAG = 1 << RANK_BITS
+INDEX_SHIFT = RANK_BITS + 1
+GENERATION_BITS = 12
+GENERATION_MASK = (1 << GENERATION_BITS) - 1
+
+
+def make_handle(rank, index, scalar=False, generation=0):
+    if scalar:
+        index = (index << GENERATION_BITS) | generation
+    return (index << INDEX_SHIFT) | (SCALAR_FLAG if scalar else 0) | rank
+
+
+def handle_slot(var_name):
+    """Slot and generation of the handle of an integer."""
+    index = var_name >> INDEX_SHIFT
+    return index >> GENERATION_BITS, index & GENERATION_MASK
+
+
+def footprint(value):
+    """Amount of bytes used by a slave to store @value.
+
+    value -- Either an `int` packed in the slab, a `list` or a `dict`.
+    """
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(map(sys.getsizeof, value))
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            itertools.starmap(item_footprint, value.items()))
+    else:
+        size = array.array(FILE_TYPECODE).itemsize
+        if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+            # Boxed aside
+            size += sys.getsizeof(value)
+        return size
+
+
+def item_footprint(key, value):
+    """Amount of bytes of an item of a dict, the dict itself excluded."""
+    return sys.getsizeof(key) + (footprint(value) if isinstance(value, list)
+                                 else sys.getsizeof(value))
+
+
+def current_rss():
+    """Resident set size of the processus in bytes, `None` if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
 
 
 class Collector:
-    def __init__(self):
-        self.comm = MPI.COMM_WORLD
+    def __init__(self, compression_threshold=COMPRESSION_THRESHOLD,
+                 metrics=False, trace=False, track_bytes=False):
+        self.comm = pkl5.Intracomm(MPI.COMM_WORLD)
+        self.metrics = Metrics(self.comm, metrics, trace)
+        self.serializer = Serializer(compression_threshold, self.metrics)
         self.rank = self.comm.Get_rank()
         self.size = self.comm.Get_size()
 
         self.__counter = 0
-        self.__vars = dict()
+        self.__vars = dict() # Lists
+        # Bytes kept up to date as the values change, without rescanning them:
+        # per list, of the boxed integers and of the items per dict. The lists
+        # and dicts are only tracked under a bytes budget.
+        self.track_bytes = track_bytes
+        self.__bytes = dict()
+        self.__boxed_bytes = 0
+        self.__dicts_bytes = collections.defaultdict(int)
+        # The integers are packed in the slab, the ones not fitting 64 bits are
+        # boxed aside. The last freed slots are reused first.
+        self.__slab = array.array(FILE_TYPECODE)
+        self.__boxed = dict()
+        self.__generations = array.array('H')
+        self.__free_slots = []
         self.__modif_history = dict()
+        self.__versions = dict()
+        self.__dicts = collections.defaultdict(dict)
+        self.__merges = [] # Partial aggregations received in advance
         self.log = logging.getLogger(' SLAVE-{}'.format(self.rank)).debug
 
 
@@ -27,43 +117,157 @@ class Collector:
     def run(self):
         while True:
             status = MPI.Status()
-            msg = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG,
-                                 status=status)
+            start = self.metrics.now()
+            envelope = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG,
+                                      status=status)
+            if self.metrics.enabled:
+                self.metrics.add_time('wait_time', start)
+            msg = self.metrics.open(envelope)
 
             source = status.Get_source()
             tag = status.Get_tag()
             action = Tags.name(tag)
+            start = self.metrics.now()
 
             if action == 'alloc':
-                new_id = self.allocate_var(msg)
-                self.comm.send(new_id, dest=source, tag=tag)
+                new_id = self.allocate_var(self.serializer.unpack(msg, 'alloc'))
+                self._send(new_id, dest=source, tag=tag)
+            elif action == 'alloc_many':
+                self._send(self.allocate_scalars(msg), dest=source, tag=tag)
             elif action == 'read':
-                self.comm.send(self.read_var(msg), dest=source, tag=tag)
+                value = self.read_var(msg[0], msg[1])
+                self._send(self.serializer.pack(value, 'read'),
+                           dest=source, tag=tag)
             elif action == 'modify':
-                self.comm.send(self.modify_var(msg[0], msg[1], msg[2], msg[3]),
-                               dest=source, tag=tag)
+                self._send(self.modify_var(msg[0], msg[1], msg[2], msg[3],
+                                           msg[4]),
+                           dest=source, tag=tag)
             elif action == 'free':
                 nb_freed = self.free_var(msg)
-                self.comm.send(nb_freed, dest=source, tag=tag)
+                self._send(nb_freed, dest=source, tag=tag)
             elif action == 'map':
-                self.map(msg[0], dill.loads(msg[1]))
+                self.map(msg[0], self.loads(msg[1], action), msg[2])
             elif action == 'filter':
-                diff_len, presence = self.filter(msg[0], dill.loads(msg[1]))
-                self.comm.send((diff_len, presence), dest=source, tag=tag)
+                self._send(self.filter(msg[0], self.loads(msg[1], action),
+                                       msg[2]),
+                           dest=source, tag=tag)
             elif action == 'reduce':
                 msg, next_dest = self.reduce(msg[0], msg[1], msg[2])
-                self.comm.send(msg, dest=next_dest, tag=Tags.reduce)
+                self._send(msg, dest=next_dest, tag=Tags.reduce)
+            elif action == 'save':
+                self.save(msg[0], msg[1], msg[2], msg[3])
+            elif action == 'load':
+                var_names = self.load(msg[0], msg[1], msg[2])
+                if len(var_names) > 0:
+                    self._send(var_names, dest=source, tag=tag)
+            elif action == 'dict_update':
+                self.dict_update(msg[0], msg[1])
+            elif action == 'dict_get':
+                self._send(self.dict_get(msg[0], msg[1]), dest=source, tag=tag)
+            elif action == 'dict_delete':
+                self._send(self.dict_delete(msg[0], msg[1]),
+                           dest=source, tag=tag)
+            elif action == 'aggregate':
+                nb_keys = self.aggregate(msg[0], msg[1],
+                                         self.loads(msg[2], action), msg[3])
+                # The bytes are only reported under a bytes budget.
+                nb_bytes = self.usage(False)['total'] if msg[4] else None
+                self._send((nb_keys, nb_bytes), dest=source, tag=tag)
+            elif action == 'dict_merge':
+                # Another slave has started the aggregation before this one.
+                self.__merges.append(msg)
+            elif action == 'summarize':
+                self._send(self.summarize(msg[0], msg[1], msg[2]),
+                           dest=source, tag=tag)
+            elif action == 'usage':
+                self._send(self.usage(msg), dest=source, tag=tag)
+            elif action == 'stats':
+                self._send(self.metrics.summary(), dest=source, tag=tag)
+            elif action == 'trace':
+                self._send(self.metrics.events, dest=source, tag=tag)
             elif action == 'quit':
                 self.quit()
             else:
                 raise ValueError("""Unkown tag {}:{}.""".format(tag, action))
 
+            if self.metrics.enabled:
+                self.metrics.add_time('compute_time', start, action)
+
+
+    def _send(self, msg, dest, tag):
+        self.comm.send(self.metrics.envelope(msg), dest=dest, tag=tag)
+
+
+    def _contains(self, var_name):
+        if var_name & SCALAR_FLAG:
+            slot, generation = handle_slot(var_name)
+            return slot < len(self.__slab) and\
+                self.__generations[slot] == generation
+        return var_name in self.__vars
+
+
+    def _not_allocated(self, var_name):
+        """The error sent back to the Master if @var_name is not allocated,
+        a freed integer's handle for instance."""
+        if not self._contains(var_name):
+            return ValueError("""The variable {} is not allocated.""".format(
+                var_name))
+
+
+    def _get(self, var_name):
+        if var_name & SCALAR_FLAG:
+            slot, _ = handle_slot(var_name)
+            if slot in self.__boxed:
+                return self.__boxed[slot]
+            return self.__slab[slot]
+        return self.__vars[var_name]
+
+
+    def _set(self, var_name, value):
+        if var_name & SCALAR_FLAG:
+            slot, _ = handle_slot(var_name)
+            if slot in self.__boxed:
+                self.__boxed_bytes -= sys.getsizeof(self.__boxed.pop(slot))
+            try:
+                self.__slab[slot] = value
+            except (OverflowError, TypeError):
+                self.__slab[slot] = 0
+                self.__boxed[slot] = value
+                self.__boxed_bytes += sys.getsizeof(value)
+        else:
+            self.__vars[var_name] = value
+            if self.track_bytes:
+                self.__bytes[var_name] = footprint(value)
+
+
+    def _set_version(self, var_name, version):
+        # Only the replicated chunks are versioned.
+        if version > 0:
+            self.__versions[var_name] = version
+
+
+    def _pop(self, var_name):
+        value = self._get(var_name)
+        if var_name & SCALAR_FLAG:
+            slot, generation = handle_slot(var_name)
+            if slot in self.__boxed:
+                self.__boxed_bytes -= sys.getsizeof(self.__boxed.pop(slot))
+            self.__generations[slot] = (generation + 1) & GENERATION_MASK
+            self.__free_slots.append(slot)
+        else:
+            self.__vars.pop(var_name)
+            self.__bytes.pop(var_name, None)
+        self.__versions.pop(var_name, None)
+        self.__modif_history.pop(var_name, None)
+
+        return value
+
 
     @log('Reducing')
     def reduce(self, var_names, fun_dump, initial_value):
-        fun = dill.loads(fun_dump)
+        fun = self.loads(fun_dump, 'reduce')
         var_name = var_names[0]
-        value = self.__vars[var_name]
+        value = self._get(var_name)
 
         if isinstance(value, int):
             initial_value = fun(initial_value, value)
@@ -80,94 +284,409 @@ class Collector:
 
 
     @log('Mapping')
-    def map(self, var_name, fun):
-        value = self.__vars[var_name]
+    def map(self, var_name, fun, version):
+        if not self._contains(var_name):
+            return # No answer to report the error
+        self._set_version(var_name, version)
+        value = self._get(var_name)
         if isinstance(value, int):
-            self.__vars[var_name] = fun(value)
+            self._set(var_name, fun(value))
         else:
             for i in range(len(value)):
                 value[i] = fun(value[i])
+            if self.track_bytes:
+                self.__bytes[var_name] = footprint(value)
 
 
     @log('Filtering')
-    def filter(self, var_name, fun):
-        value = self.__vars[var_name]
+    def filter(self, var_name, fun, version):
+        if not self._contains(var_name):
+            return self._not_allocated(var_name)
+        self._set_version(var_name, version)
+        value = self._get(var_name)
         if isinstance(value, int):
             if not fun(value):
-                self.__vars.pop(var_name)
+                self._pop(var_name)
                 return 1, False
             return 0, True
         else:
             original_len = len(self.__vars[var_name])
-            self.__vars[var_name] = list(filter(fun, value))
+            self._set(var_name, list(filter(fun, value)))
 
             new_len = len(self.__vars[var_name])
             diff_len = original_len - new_len
             if new_len == 0:
-                self.__vars.pop(var_name)
+                self._pop(var_name)
                 return diff_len, False
             return diff_len, True
 
 
     @log('Allocating')
     def allocate_var(self, value):
-        var_name = '{}-{}'.format(self.rank, self.__counter)
-        self.__vars[var_name] = value
+        if isinstance(value, int):
+            return self.allocate_scalars([value])[0]
+
+        var_name = make_handle(self.rank, self.__counter)
+        self._set(var_name, value)
         self.__counter += 1
 
         return var_name
 
 
+    @log('Allocating integers')
+    def allocate_scalars(self, values):
+        var_names = []
+        for value in values:
+            if self.__free_slots:
+                slot = self.__free_slots.pop()
+            else:
+                slot = len(self.__slab)
+                self.__slab.append(0)
+                self.__generations.append(0)
+
+            var_name = make_handle(self.rank, slot, scalar=True,
+                                   generation=self.__generations[slot])
+            self._set(var_name, value)
+            var_names.append(var_name)
+
+        return var_names
+
+
     @log('Reading')
-    def read_var(self, var_name):
-        return self.__vars[var_name]
+    def read_var(self, var_name, version):
+        """Returns `None` if the copy is older than the @version expected."""
+        if not self._contains(var_name):
+            return self._not_allocated(var_name)
+        if self.__versions.get(var_name, 0) < version:
+            return None
+        return self._get(var_name)
 
 
     @log('Modifying')
-    def modify_var(self, var_name, new_value, index, time_master):
-        if var_name in self.__vars and isinstance(self.__vars[var_name], int):
+    def modify_var(self, var_name, new_value, index, time_master, version):
+        if not self._contains(var_name):
+            return self._not_allocated(var_name)
+
+        if var_name & SCALAR_FLAG:
             if var_name in self.__modif_history and\
                (time_master < self.__modif_history[var_name][0] or\
                  not self.__modif_history[var_name][1]) :
                  return False
 
             self.__modif_history[var_name] = [time.time(), False]
-            self.__vars[var_name] = new_value
+            self._set(var_name, new_value)
             self.__modif_history[var_name] = [time.time(), True]
+            # Only a write applied makes the copy up to date.
+            self._set_version(var_name, version)
 
             return True
-        elif var_name in self.__vars and isinstance(self.__vars[var_name], list):
+        else:
             if var_name in self.__modif_history and\
                (time_master < self.__modif_history[var_name][0] or\
                  not self.__modif_history[var_name][1]) :
                  return False
 
             self.__modif_history[var_name] = [time.time(), False]
-            self.__vars[var_name][index] = new_value
+            value = self.__vars[var_name]
+            if self.track_bytes:
+                self.__bytes[var_name] += sys.getsizeof(new_value) -\
+                    sys.getsizeof(value[index])
+            value[index] = new_value
             self.__modif_history[var_name] = [time.time(), True]
+            self._set_version(var_name, version)
 
             return True
-        else:
-            return False
 
 
     @log('Freeing')
     def free_var(self, var_name):
-        value = self.__vars.pop(var_name)
+        """Returns the amount of elements and of bytes freed."""
+        if not self._contains(var_name):
+            return self._not_allocated(var_name)
+        nb_bytes = self.__bytes.get(var_name, 0)
+        value = self._pop(var_name)
 
         if isinstance(value, int):
-            return 1
+            return 1, footprint(value)
         else:
-            return len(value)
+            return len(value), nb_bytes
+
+
+    @log('Usage')
+    def usage(self, detailed):
+        """Returns the amount of bytes used by the variables and dicts.
+
+        The bytes used per chunk and per dict are only detailed if @detailed.
+        The slab counts every slot, freed ones included. The bytes are kept up
+        to date by every operation under a bytes budget, the values are only
+        scanned without.
+        """
+        if self.track_bytes:
+            chunks = self.__bytes
+            dicts = {dict_name: sys.getsizeof(values) + self.__dicts_bytes[dict_name]
+                     for dict_name, values in self.__dicts.items()}
+        else: # Scanned, without budget the Master seldom asks
+            chunks = {var_name: footprint(value)
+                      for var_name, value in self.__vars.items()}
+            dicts = {dict_name: footprint(values)
+                     for dict_name, values in self.__dicts.items()}
+        slab = self.__slab.buffer_info()[1] * self.__slab.itemsize +\
+            self.__boxed_bytes
+
+        report = {
+            'total': sum(chunks.values()) + slab + sum(dicts.values()),
+            'slab': slab,
+            'rss': current_rss(),
+        }
+        if detailed:
+            report['chunks'] = dict(chunks)
+            report['dicts'] = dicts
+
+        return report
+
+
+    @log('Saving')
+    def save(self, path, chunks, nb_rounds, total_size):
+        """Write the local @chunks at their offset in the file @path.
+
+        The values are converted before the collective calls: no processus
+        opens the file if one of them does not fit 64 bits.
+        """
+        buffers = []
+        error = None
+        for var_name, offset in chunks:
+            value = self._get(var_name)
+            try:
+                buffers.append((offset, array.array(
+                    FILE_TYPECODE, [value] if isinstance(value, int) else value)))
+            except (OverflowError, TypeError) as e:
+                error = str(e)
+                break
+
+        if any(self.comm.allgather(error)):
+            return
+
+        fh = MPI.File.Open(self.comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+        fh.Set_size(total_size)
+        # Every process must take part to the same number of collective writes.
+        for i in range(nb_rounds):
+            if i < len(buffers):
+                fh.Write_at_all(*buffers[i])
+            else:
+                fh.Write_at_all(0, array.array(FILE_TYPECODE))
+        fh.Close()
+
+
+    @log('Loading')
+    def load(self, path, chunks, nb_rounds):
+        fh = MPI.File.Open(self.comm, path, MPI.MODE_RDONLY)
+        var_names = []
+        for i in range(nb_rounds):
+            if i < len(chunks):
+                offset, amount = chunks[i]
+                buf = array.array(FILE_TYPECODE, [0]) * amount
+                fh.Read_at_all(offset, buf)
+                var_names.append(self.allocate_var(buf.tolist()))
+            else:
+                fh.Read_at_all(0, array.array(FILE_TYPECODE))
+        fh.Close()
+
+        return var_names
+
+
+    @log('Summarizing')
+    def summarize(self, var_names, kind, arg):
+        """Summarize the local chunks @var_names of a variable.
+
+        kind -- 'topk': the @arg largest values in decreasing order.
+                'range': the minimum, the maximum and the amount of values.
+                'histogram': the counts of values per bin, @arg being the
+                             bins' edges. The last bin includes its right edge.
+                'sketch': at most @arg `(value, weight)` evenly spaced in the
+                          sorted values, from the minimum to the maximum,
+                          and the amount of values.
+        """
+        values = itertools.chain.from_iterable(
+            [value] if isinstance(value, int) else value
+            for value in map(self._get, var_names))
+
+        if kind == 'topk':
+            return heapq.nlargest(arg, values)
+        elif kind == 'range':
+            low, high, n = None, None, 0
+            for v in values:
+                if n == 0 or v < low:
+                    low = v
+                if n == 0 or v > high:
+                    high = v
+                n += 1
+            return low, high, n
+        elif kind == 'histogram':
+            counts = [0] * (len(arg) - 1)
+            for v in values:
+                i = bisect.bisect_right(arg, v) - 1
+                if i == len(counts) and v == arg[-1]:
+                    i -= 1
+                if 0 <= i < len(counts):
+                    counts[i] += 1
+            return counts
+        elif kind == 'sketch':
+            values = sorted(values)
+            n = len(values)
+            if n <= arg:
+                return [(v, 1) for v in values], n
+            # The minimum and the maximum are always part of the sketch.
+            return [(values[j * (n - 1) // (arg - 1)], n / arg)
+                    for j in range(arg)], n
+        else:
+            raise ValueError("""Unknown summary {}.""".format(kind))
+
+
+    @log('Updating dict')
+    def dict_update(self, dict_name, items):
+        values = self.__dicts[dict_name]
+        if self.track_bytes:
+            nb_bytes = 0
+            for key, value in items.items():
+                if key in values:
+                    nb_bytes -= item_footprint(key, values[key])
+                nb_bytes += item_footprint(key, value)
+            self.__dicts_bytes[dict_name] += nb_bytes
+        values.update(items)
+
+
+    @log('Getting from dict')
+    def dict_get(self, dict_name, keys):
+        """Returns the items of @keys present in the dict, every items if @keys
+        is `None`."""
+        values = self.__dicts.get(dict_name, dict())
+        if keys is None:
+            return values
+        return {key: values[key] for key in keys if key in values}
+
+
+    @log('Deleting from dict')
+    def dict_delete(self, dict_name, keys):
+        """Returns the amount of deleted keys, deletes the dict if @keys is
+        `None`."""
+        if keys is None:
+            self.__dicts_bytes.pop(dict_name, None)
+            return len(self.__dicts.pop(dict_name, dict()))
+
+        values = self.__dicts.get(dict_name, dict())
+        nb_deleted = 0
+        for key in keys:
+            if key in values:
+                value = values.pop(key)
+                if self.track_bytes:
+                    self.__dicts_bytes[dict_name] -= item_footprint(key, value)
+                nb_deleted += 1
+        return nb_deleted
+
+
+    @log('Aggregating')
+    def aggregate(self, dict_name, chunks, fun, kind):
+        """Aggregate the local @chunks into the dict @dict_name, partitioned
+        over every slave.
+
+        chunks -- List of `(position, var_name)`, the position of the chunk in
+                  its variable keeps the groups ordered.
+        kind   -- Either 'count' or 'group'.
+
+        Returns the amount of keys stored by this slave, or a `ValueError` if
+        a key is neither an `int` nor a `str`.
+        """
+        nb_slaves = self.size - 1
+        partials = collections.defaultdict(list)
+        error = None
+        for position, var_name in chunks:
+            value = self._get(var_name)
+            values = [value] if isinstance(value, int) else value
+
+            chunk_partials = collections.defaultdict(dict)
+            for v in values:
+                key = v if fun is None else fun(v)
+                if not isinstance(key, int) and not isinstance(key, str):
+                    error = ValueError("""Expecting either an `int` or a `str`
+                                          key, not a `{}`""".format(
+                                              type(key).__name__))
+                    break
+                partial = chunk_partials[Collector.get_key_slave_id(key, nb_slaves)]
+                if kind == 'count':
+                    partial[key] = partial.get(key, 0) + 1
+                else:
+                    partial.setdefault(key, []).append(v)
+
+            if error is not None:
+                # The other slaves still expect the partials of this one.
+                partials.clear()
+                break
+            for slave_id, partial in chunk_partials.items():
+                partials[slave_id].append((position, partial))
+
+        requests = []
+        for slave_id in range(1, self.size):
+            msg = (dict_name, partials[slave_id])
+            requests.append(self.comm.isend(self.metrics.envelope(msg),
+                                            dest=slave_id, tag=Tags.dict_merge))
+
+        received = [m for m in self.__merges if m[0] == dict_name]
+        self.__merges = [m for m in self.__merges if m[0] != dict_name]
+        while len(received) < nb_slaves:
+            msg = self.metrics.open(self.comm.recv(source=MPI.ANY_SOURCE,
+                                                   tag=Tags.dict_merge))
+            if msg[0] == dict_name:
+                received.append(msg)
+            else:
+                self.__merges.append(msg)
+
+        values = self.__dicts[dict_name]
+        chunk_partials = sorted((chunk_partial for _, slave_partials in received
+                                 for chunk_partial in slave_partials),
+                                key=lambda x: x[0])
+        for _, partial in chunk_partials:
+            for key, v in partial.items():
+                if kind == 'count':
+                    values[key] = values.get(key, 0) + v
+                else:
+                    values.setdefault(key, []).extend(v)
+        if self.track_bytes:
+            self.__dicts_bytes[dict_name] = sum(
+                itertools.starmap(item_footprint, values.items()))
+
+        for req in requests:
+            req.wait()
+
+        return len(values) if error is None else error
+
+
+    def loads(self, fun_dump, op):
+        """Load a function dumped, and maybe packed, by the Master."""
+        return dill.loads(self.serializer.unpack(fun_dump, op))
 
 
     @classmethod
     def get_slave_id(self, var_name):
-        if not isinstance(var_name, str):
-            raise ValueError("""The var_name must be a 'str'
+        if not isinstance(var_name, int):
+            raise ValueError("""The var_name must be an 'int'
                                 not a {}.""".format(type(var_name).__name__))
 
-        return int(var_name.split('-')[0])
+        return var_name & RANK_MASK
+
+
+    @classmethod
+    def get_key_slave_id(self, key, nb_slaves):
+        """Slave hosting @key in a distributed dict.
+
+        The hash must be the same on every processus: Python's `hash` of a
+        `str` is salted per processus.
+        """
+        if isinstance(key, int):
+            key_hash = key
+        else:
+            key_hash = zlib.crc32(repr(key).encode())
+
+        return 1 + key_hash % nb_slaves
 
 
     @log('Exiting')
@@ -4,7 +4,16 @@ def log(msg):
     def wrapper(f):
         def wrap(self, *args, **kwargs):
             self.log(pretty_log(msg, self, args, kwargs))
-            return f(self, *args, **kwargs)
+
+            metrics = getattr(self, 'metrics', None)
+            if metrics is None or not metrics.enabled:
+                return f(self, *args, **kwargs)
+
+            start = metrics.now()
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                metrics.record(f.__name__, start)
         return wrap
     return wrapper
 
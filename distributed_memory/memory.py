@@ -1,33 +1,81 @@
 """This module is the main Memory that acts as interface between the user and
 the distributed memory."""
 
+import array
 import collections
+import heapq
+import itertools
+import json
 import logging
 import math
+import os
+import sys
 import time
 
 from mpi4py import MPI
+from mpi4py.util import pkl5
 import dill
 
 from .tags import Tags
-from .collector import Collector
+from .collector import Collector, FILE_TYPECODE, footprint, item_footprint
 from .logger import log
+from .metrics import Metrics
+from .serializer import Serializer, COMPRESSION_THRESHOLD
 
 
 class Variable:
-    def __init__(self, var_names, var_type):
+    __slots__ = ('var_names', 'var_type', 'replicas')
+
+    def __init__(self, var_names, var_type, replicas=None):
         self.var_names = var_names
         self.var_type = var_type
+        # Primary chunk name -> names of its replicas on other slaves, `None`
+        # if not replicated.
+        self.replicas = replicas or None
 
 
     def __bool__(self):
         return len(self.var_names) > 0
 
 
-def init_memory(*, max_per_slave):
+    def copies(self, var_name):
+        """Names of every copy of the chunk @var_name, primary first."""
+        if self.replicas is None:
+            return [var_name]
+        return [var_name] + self.replicas.get(var_name, [])
+
+
+def as_variable(var):
+    """The `Variable` of @var, which may also be the `int` handle of an integer
+    added by `Memory.add_many`."""
+    if isinstance(var, int):
+        return Variable([var], int)
+    return var
+
+
+class DistributedDict:
+    def __init__(self, dict_name):
+        self.dict_name = dict_name
+
+
+# Bytes of an element loaded from a file: the pointer in the `list` and the
+# biggest 64-bit `int`.
+LOADED_ELEMENT_SIZE = 8 + sys.getsizeof(2 ** 62)
+
+
+def init_memory(*, max_per_slave=None, max_bytes_per_slave=None,
+                compression_threshold=COMPRESSION_THRESHOLD,
+                metrics=False, trace=False):
     """Entry point to the distributed memory.
 
-    max_per_slave -- Maximum amount of elements stored by a slave.
+    max_per_slave         -- Maximum amount of elements stored by a slave.
+    max_bytes_per_slave   -- Maximum amount of bytes stored by a slave, as
+                             measured by the slaves.
+    compression_threshold -- Minimum amount of bytes of a message's payload to
+                             compress it. `None` disables the compression.
+    metrics               -- Whether every processus records its metrics.
+    trace                 -- Whether every processus records its timeline,
+                             implies @metrics.
 
     Returns a `Memory` object. Every variables manipulation are made throught
     this interface. No need to handle the current processus' rank.
@@ -42,22 +90,40 @@ def init_memory(*, max_per_slave):
     if MPI.COMM_WORLD.Get_size() < 2:
         raise Exception("""At least 2 hosts are needed.""")
 
+    if max_per_slave is None and max_bytes_per_slave is None:
+        raise ValueError("""Either @max_per_slave or @max_bytes_per_slave
+                            is needed.""")
+
     if isinstance(max_per_slave, float):
         max_per_slave = math.ceil(max_per_slave)
+    if isinstance(max_bytes_per_slave, float):
+        max_bytes_per_slave = math.floor(max_bytes_per_slave)
 
     if MPI.COMM_WORLD.Get_rank() == 0:
-        return Memory(max_per_slave=max_per_slave)
-
-    collector = Collector()
+        return Memory(max_per_slave=max_per_slave,
+                      max_bytes_per_slave=max_bytes_per_slave,
+                      compression_threshold=compression_threshold,
+                      metrics=metrics, trace=trace)
+
+    collector = Collector(compression_threshold=compression_threshold,
+                          metrics=metrics, trace=trace,
+                          track_bytes=max_bytes_per_slave is not None)
     collector.run()
 
 
 class Memory:
     """Interface to the distributed memory and Master in the centralized topology."""
-    def __init__(self, *, max_per_slave):
+    def __init__(self, *, max_per_slave=None, max_bytes_per_slave=None,
+                 compression_threshold=COMPRESSION_THRESHOLD,
+                 metrics=False, trace=False):
         """Init a `Memory`.
 
-        max_per_slave -- Maximum amount of elements stored by a slave.
+        max_per_slave         -- Maximum amount of elements stored by a slave.
+        max_bytes_per_slave   -- Maximum amount of bytes stored by a slave.
+        compression_threshold -- Minimum amount of bytes of a message's payload
+                                 to compress it.
+        metrics               -- Whether every processus records its metrics.
+        trace                 -- Whether every processus records its timeline.
 
         The user should initialize himself the `Memory`, the function
         `init_memory` should be used instead.
@@ -65,40 +131,133 @@ class Memory:
         self.log = logging.getLogger(' Master').info
         self.log('Starting Memory...')
 
-        self.comm = MPI.COMM_WORLD
+        # Pickle protocol 5: the packed payloads are sent out-of-band.
+        self.comm = pkl5.Intracomm(MPI.COMM_WORLD)
+        self.metrics = Metrics(self.comm, metrics, trace)
+        self.serializer = Serializer(compression_threshold, self.metrics)
 
         self.nb_slaves = self.comm.Get_size() - 1 # Minus Master
         self.max_per_slave = max_per_slave
+        self.max_bytes_per_slave = max_bytes_per_slave
         self.slaves_tracking = collections.defaultdict(int)
+        self.bytes_tracking = collections.defaultdict(int)
+        # Slaves whose bytes may have changed since their last report.
+        self.stale_slaves = set()
         self.list_tracking = dict()
+        self.versions = collections.defaultdict(int) # Replicated chunks only
 
+        # Messages sent to each slave and not yet processed. `True` marks a
+        # message expecting an answer.
+        self.pending = collections.defaultdict(collections.deque)
+        # The sending requests must live until completion, the out-of-band
+        # buffers would be freed otherwise.
+        self.requests = []
+        self.slaves_reads = collections.defaultdict(int)
+        self.dicts_counter = 0
+        # Timestamps the writes: a slave refuses a write older than its last.
+        self.clock = time.time
 
-    @log('Add')
-    def add(self, var):
-        """Add a variable @var to the distributed memory.
 
-        var -- Variable to add to the distributed memory. Either an `int` of a
-               `list` of `int`.
+    def _send(self, msg, dest, tag, answer=True):
+        """Send asynchronously @msg to the slave @dest."""
+        self.pending[dest].append(answer)
+        self.requests = [req for req in self.requests if not req.test()[0]]
 
-        Ex:
-        >>> var1 = mem.add([1, 2, 3])
-        >>> var2 = mem.add(42)
+        req = self.comm.isend(self.metrics.envelope(msg), dest=dest, tag=tag)
+        self.requests.append(req)
+        return req
+
+
+    def _recv(self, source, tag):
+        """Receive an answer from the slave @source."""
+        start = self.metrics.now()
+        envelope = self.comm.recv(source=source, tag=tag)
+        if self.metrics.enabled:
+            self.metrics.add_time('wait_time', start, 'wait')
+        msg = self.metrics.open(envelope)
+
+        # A slave processes its messages in order: everything sent before the
+        # answered message is done.
+        pending = self.pending[source]
+        if True in pending:
+            while not pending.popleft():
+                pass
+
+        if isinstance(msg, Exception): # Sent back by the slave
+            raise msg
+
+        return msg
+
+
+    def bytes_saved(self):
+        """Returns the amount of bytes saved per operation by the packing of
+        the messages' payloads."""
+        return self.serializer.bytes_saved()
+
+
+    def queue_depth(self, slave_id):
+        """Amount of messages sent to the slave @slave_id not yet processed."""
+        return len(self.pending[slave_id])
+
+
+    def _pick_copy(self, var, var_name):
+        """Choose the least loaded copy of the chunk @var_name."""
+        copy_name = min(var.copies(var_name), key=lambda name: (
+            self.queue_depth(Collector.get_slave_id(name)),
+            self.slaves_reads[Collector.get_slave_id(name)]))
+        self.slaves_reads[Collector.get_slave_id(copy_name)] += 1
+
+        return copy_name
+
+
+    def _footprint(self, value):
+        """Bytes used by @value once stored, 0 without bytes budget.
+
+        The bytes are only tracked with a budget.
         """
-        if not isinstance(var, int) and not isinstance(var, list):
-            raise ValueError("""Expecting either an `int` or a `list`,
-                                not a `{}`""".format(type(var).__name__))
+        if self.max_bytes_per_slave is None:
+            return 0
+        return footprint(value)
+
+
+    def _capacity(self, slave_id, element_size):
+        """Amount of elements of @element_size bytes that the slave @slave_id
+        can still host."""
+        capacity = math.inf
+        if self.max_per_slave is not None:
+            capacity = self.max_per_slave - self.slaves_tracking[slave_id]
+        if self.max_bytes_per_slave is not None and element_size > 0:
+            remaining_bytes = self.max_bytes_per_slave - self.bytes_tracking[slave_id]
+            capacity = min(capacity, int(remaining_bytes // element_size))
+
+        return max(0, capacity)
+
+
+    def _select_slaves(self, var_size, element_size=0, replication=1):
+        """Choose the slaves that will host @var_size elements.
+
+        element_size -- Amount of bytes per element.
+        replication  -- Amount of copies of each chunk: only this share of a
+                        slave is used, the rest is left to the replicas of
+                        the other chunks.
+
+        Returns a list of `(slave_id, amount)`.
+        """
+        self._refresh_usage()
+
+        def capacity(slave_id):
+            return self._capacity(slave_id, element_size) // replication
 
-        # Choosing the slaves
-        var_size = 1 if isinstance(var, int) else len(var)
         selected_slaves = []
         for slave_id in range(1, self.nb_slaves+1):
-            if self.slaves_tracking[slave_id] + var_size < self.max_per_slave:
+            if var_size < capacity(slave_id):
                 selected_slaves = [(slave_id, var_size)]
                 break # Try to fit the whole variable into a single slave
         else: # Place portion of the variable into several slaves
-            smallest_slaves = sorted(self.slaves_tracking.items(), key=lambda x: x[1])
-            for (slave_id, size) in smallest_slaves:
-                remaining_size = self.max_per_slave - size
+            largest_slaves = sorted(range(1, self.nb_slaves+1),
+                                    key=lambda x: -capacity(x))
+            for slave_id in largest_slaves:
+                remaining_size = capacity(slave_id)
 
                 if remaining_size == 0 and var_size > 0:
                     raise Exception("""Not enough memory! 1""")
@@ -112,40 +271,219 @@ class Memory:
             else:
                 raise Exception("""Not enough memory! 2""")
 
+        return selected_slaves
+
+
+    def _select_replicas(self, hosts, amount, element_size=0):
+        """Choose the slave that will host a replica of @amount elements.
+
+        hosts        -- Slaves already hosting a copy of the chunk, primary
+                        first.
+        element_size -- Amount of bytes per element.
+
+        Among the largest slaves, the ones following the primary come first:
+        the replicas of consecutive chunks rotate over the slaves.
+        """
+        candidates = sorted(
+            (-self._capacity(slave_id, element_size),
+             (slave_id - hosts[0]) % self.nb_slaves, slave_id)
+            for slave_id in range(1, self.nb_slaves+1)
+            if slave_id not in hosts)
+        for capacity, _, slave_id in candidates:
+            if -capacity >= amount:
+                return slave_id
+
+        raise Exception("""Not enough memory for the replicas!""")
+
+
+    def _reserve(self, slave_id, amount, nb_bytes):
+        self.slaves_tracking[slave_id] += amount
+        self._track_bytes(slave_id, nb_bytes)
+
+
+    def _track_bytes(self, slave_id, nb_bytes):
+        if self.max_bytes_per_slave is not None:
+            self.bytes_tracking[slave_id] += nb_bytes
+
+
+    def _plan_copies(self, var_size, element_size, replication):
+        """Choose the slaves hosting every copy of every chunk of @var_size
+        elements, before anything is sent.
+
+        The capacity is reserved as the copies are placed, the replicas after
+        all the primary chunks. Nothing stays reserved if a copy does not fit.
+
+        Returns a list of `(amount, slave_ids)`, primary slave first.
+        """
+        plan = []
+        try:
+            for slave_id, amount in self._select_slaves(var_size, element_size,
+                                                        replication):
+                self._reserve(slave_id, amount, math.ceil(amount * element_size))
+                plan.append((amount, [slave_id]))
+
+            for amount, hosts in plan:
+                for _ in range(replication - 1):
+                    replica_id = self._select_replicas(hosts, amount, element_size)
+                    self._reserve(replica_id, amount,
+                                  math.ceil(amount * element_size))
+                    hosts.append(replica_id)
+        except Exception:
+            for amount, hosts in plan:
+                for slave_id in hosts:
+                    self._reserve(slave_id, -amount,
+                                  -math.ceil(amount * element_size))
+            raise
+
+        return plan
+
+
+    def _refresh_usage(self):
+        """Update the bytes used by the stale slaves, if there is a budget."""
+        if self.max_bytes_per_slave is not None and self.stale_slaves:
+            self._query_usage(sorted(self.stale_slaves), detailed=False)
+
+
+    def _query_usage(self, slave_ids, detailed):
+        for slave_id in slave_ids:
+            self._send(detailed, dest=slave_id, tag=Tags.usage)
+
+        reports = dict()
+        for slave_id in slave_ids:
+            reports[slave_id] = self._recv(source=slave_id, tag=Tags.usage)
+            if self.max_bytes_per_slave is not None:
+                self.bytes_tracking[slave_id] = reports[slave_id]['total']
+            self.stale_slaves.discard(slave_id)
+
+        return reports
+
+
+    @log('Usage')
+    def usage(self):
+        """Returns the memory used by each slave.
+
+        Per slave: the amount of elements, the bytes used in total, by each
+        chunk of list, by the slab of integers and by each dict, and the
+        resident set size of the processus (`None` if unknown).
+
+        Ex:
+        >>> var = mem.add([1, 2, 3])
+        >>> sorted(mem.usage()[1])
+        ['chunks', 'dicts', 'elements', 'rss', 'slab', 'total']
+        """
+        reports = self._query_usage(range(1, self.nb_slaves+1), detailed=True)
+        for slave_id, report in reports.items():
+            report['elements'] = self.slaves_tracking[slave_id]
+
+        return reports
+
+
+    @log('Add')
+    def add(self, var, replication=1):
+        """Add a variable @var to the distributed memory.
+
+        var         -- Variable to add to the distributed memory. Either an
+                       `int` of a `list` of `int`.
+        replication -- Amount of copies of each chunk, each on a different
+                       slave. The reads are spread over the copies.
+
+        Ex:
+        >>> var1 = mem.add([1, 2, 3])
+        >>> var2 = mem.add(42, replication=2)
+        """
+        if not isinstance(var, int) and not isinstance(var, list):
+            raise ValueError("""Expecting either an `int` or a `list`,
+                                not a `{}`""".format(type(var).__name__))
+        if not 1 <= replication <= self.nb_slaves:
+            raise ValueError("""@replication must be between 1 and {},
+                                not {}.""".format(self.nb_slaves, replication))
+
+        var_size = 1 if isinstance(var, int) else len(var)
+        element_size = self._footprint(var) / max(1, var_size)
+        plan = self._plan_copies(var_size, element_size, replication)
+
         accumulated_amount = 0
-        if isinstance(var, int): # Single integer
-            slave_id, _ = selected_slaves[0]
-            self.comm.isend(var, dest=slave_id, tag=Tags.alloc)
-            self.slaves_tracking[slave_id] += 1
-        else: # List
-            tmp_list_tracking = []
-            for slave_id, amount in selected_slaves:
-                low_bound = accumulated_amount
-                high_bound = accumulated_amount + amount
-
-                tmp_list_tracking.append((low_bound, high_bound-1))
-                self.comm.isend(var[low_bound:high_bound],
-                                dest=slave_id, tag=Tags.alloc)
-
-                self.slaves_tracking[slave_id] += amount
-                accumulated_amount += amount
+        tmp_list_tracking = []
+        sent = [] # (chunk index, slave_id) in sending order
+        for i, (amount, hosts) in enumerate(plan):
+            low_bound = accumulated_amount
+            high_bound = accumulated_amount + amount
+            if isinstance(var, int): # Single integer
+                value = var
+            else: # List
+                value = self.serializer.pack(var[low_bound:high_bound], 'alloc')
+            tmp_list_tracking.append((low_bound, high_bound-1))
+
+            for slave_id in hosts:
+                self._send(value, dest=slave_id, tag=Tags.alloc)
+                sent.append((i, slave_id))
+            accumulated_amount += amount
 
         # Gathering the id associated to the newly allocated variable
         var_names = []
-        for i, (slave_id, _) in enumerate(selected_slaves):
-            var_name = self.comm.recv(source=slave_id, tag=Tags.alloc)
-            var_names.append(var_name)
+        replicas = dict()
+        for i, slave_id in sent:
+            var_name = self._recv(source=slave_id, tag=Tags.alloc)
+            if i == len(var_names): # Primary copy
+                var_names.append(var_name)
+                if isinstance(var, list):
+                    self.list_tracking[var_name] = tmp_list_tracking[i]
+            else:
+                replicas.setdefault(var_names[i], []).append(var_name)
+
+        return Variable(var_names, type(var), replicas)
+
+
+    @log('Add many')
+    def add_many(self, values):
+        """Add each `int` of @values as a distinct variable.
+
+        The integers are packed in the slabs of the slaves, with a single
+        message per slave. Returns an `array` of their `int` handles, 8 bytes
+        each on the Master, usable wherever a `Variable` is expected. Unlike a
+        `Variable`, a handle is not emptied once freed: the slave raises a
+        `ValueError` if it is used again.
+
+        values -- `list` of `int`.
+
+        Ex:
+        >>> var1, var2 = mem.add_many([1, 2])
+        >>> mem.read(var2)
+        2
+        """
+        for value in values:
+            if not isinstance(value, int):
+                raise ValueError("""Expecting `int` values,
+                                    not a `{}`""".format(type(value).__name__))
+        if len(values) == 0:
+            return array.array('q')
+
+        values_bytes = [self._footprint(value) for value in values]
+        selected_slaves = self._select_slaves(
+            len(values), max(values_bytes))
+
+        accumulated_amount = 0
+        for slave_id, amount in selected_slaves:
+            high_bound = accumulated_amount + amount
+            self._send(values[accumulated_amount:high_bound],
+                       dest=slave_id, tag=Tags.alloc_many)
+            self._reserve(slave_id, amount,
+                          sum(values_bytes[accumulated_amount:high_bound]))
+            accumulated_amount += amount
 
-            if isinstance(var, list):
-                self.list_tracking[var_name] = tmp_list_tracking[i]
+        handles = array.array('q')
+        for slave_id, _ in selected_slaves:
+            handles.extend(self._recv(source=slave_id, tag=Tags.alloc_many))
 
-        return Variable(var_names, type(var))
+        return handles
 
 
     @log('Read')
     def read(self, var):
         """Read a variable @var_name from the distributed memory.
 
+        Each chunk is read from its least loaded copy.
+
         var -- `Variable` instance
 
         Ex:
@@ -156,18 +494,33 @@ class Memory:
         >>> mem.read(var2)
         [1, 2, 3]
         """
+        var = as_variable(var)
         if not var:
             raise ValueError("""@var is not allocated.""")
 
-        values = []
+        copies = []
         for var_name in var.var_names:
-            slave_id = Collector.get_slave_id(var_name)
-            self.comm.isend(var_name, dest=slave_id, tag=Tags.read)
-            var = self.comm.recv(source=slave_id, tag=Tags.read)
-            if isinstance(var, int):
-                return var
+            copy_name = self._pick_copy(var, var_name)
+            slave_id = Collector.get_slave_id(copy_name)
+            self._send((copy_name, self.versions.get(var_name, 0)),
+                       dest=slave_id, tag=Tags.read)
+            copies.append((var_name, slave_id))
+
+        values = []
+        for var_name, slave_id in copies:
+            value = self.serializer.unpack(
+                self._recv(source=slave_id, tag=Tags.read), 'read')
+            if value is None: # Outdated replica, falling back on the primary
+                slave_id = Collector.get_slave_id(var_name)
+                self._send((var_name, self.versions.get(var_name, 0)),
+                           dest=slave_id, tag=Tags.read)
+                value = self.serializer.unpack(
+                    self._recv(source=slave_id, tag=Tags.read), 'read')
+
+            if isinstance(value, int):
+                return value
             else:
-                values.extend(var)
+                values.extend(value)
 
         return values
 
@@ -188,37 +541,101 @@ class Memory:
         >>> mem.read(var)
         1337
         """
+        var = as_variable(var)
         if not isinstance(new_value, int):
             raise ValueError("""@new_value must be of type `int`
                                 not {}.""".format(type(new_value).__name__))
 
         if var.var_type == int:
-            slave_id = Collector.get_slave_id(var.var_names[0])
-            self.comm.isend((var.var_names[0], new_value, index, time.time()),
-                           dest=slave_id, tag=Tags.modify)
-
-            return self.comm.recv(source=slave_id, tag=Tags.modify)
+            return self._modify_copies(var, var.var_names[0], new_value, index)
         else:
             if not isinstance(index, int):
                 raise ValueError("""Index must be an integer
                                     not {}.""".format(type(index).__name__))
 
-            accumulated_index = 0
-            for var_i, var_name in enumerate(var.var_names):
+            for var_name in var.var_names:
                 low_bound, high_bound = self.list_tracking[var_name]
                 if low_bound <= index <= high_bound:
-                    if var_i != 0:
-                        index = index - accumulated_index - 1
-                    slave_id = Collector.get_slave_id(var_name)
+                    return self._modify_copies(var, var_name, new_value,
+                                               index - low_bound)
 
-                    self.comm.isend((var_name, new_value, index, time.time()),
-                                   dest=slave_id, tag=Tags.modify)
+        raise Exception("""Out of bounds error with index {}.""".format(index))
 
-                    return self.comm.recv(source=slave_id, tag=Tags.modify)
-                else:
-                    accumulated_index += high_bound
 
-        raise Exception("""Out of bounds error with index {}.""".format(index))
+    def _bump_version(self, var, var_name):
+        """New version of the chunk @var_name before writing it.
+
+        Only the replicated chunks are versioned, the others stay at 0.
+        """
+        if var.replicas is None:
+            return 0
+
+        self.versions[var_name] += 1
+        return self.versions[var_name]
+
+
+    def _modify_copies(self, var, var_name, new_value, index):
+        """Modify every copy of the chunk @var_name.
+
+        Returns whether the primary copy has applied the modification. The
+        replicas which disagree with it are freed, the others stay in sync.
+        """
+        version = self._bump_version(var, var_name)
+        msg_time = self.clock()
+        for copy_name in var.copies(var_name):
+            slave_id = Collector.get_slave_id(copy_name)
+            msg = (copy_name, new_value, index, msg_time, version)
+            self._send(msg, dest=slave_id, tag=Tags.modify)
+            self.stale_slaves.add(slave_id)
+
+        results, errors = [], []
+        for copy_name in var.copies(var_name):
+            try:
+                results.append(self._recv(source=Collector.get_slave_id(copy_name),
+                                          tag=Tags.modify))
+            except ValueError as e: # Every answer is received first
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+        # The primary copy decides, the copies disagreeing with it are dropped.
+        applied = results[0]
+        diverged = [copy_name for copy_name, result
+                    in zip(var.copies(var_name), results) if result != applied]
+        if diverged:
+            self._free_copies(diverged)
+            var.replicas[var_name] = [copy_name for copy_name
+                                      in var.replicas[var_name]
+                                      if copy_name not in diverged]
+        if not applied and version > 0:
+            self.versions[var_name] -= 1
+
+        return applied
+
+
+    def _free_copies(self, copy_names):
+        """Free the chunks @copy_names on their slaves."""
+        for copy_name in copy_names:
+            slave_id = Collector.get_slave_id(copy_name)
+            self._send(copy_name, dest=slave_id, tag=Tags.free)
+
+        errors = []
+        for copy_name in copy_names:
+            slave_id = Collector.get_slave_id(copy_name)
+
+            try:
+                nb_freed, nb_bytes = self._recv(source=slave_id, tag=Tags.free)
+            except ValueError as e: # Every answer is received first
+                errors.append(e)
+                continue
+            # Remove any info related to @var_name while send is processing.
+            self.slaves_tracking[slave_id] -= nb_freed
+            self._track_bytes(slave_id, -nb_bytes)
+            self.list_tracking.pop(copy_name, None)
+            self.versions.pop(copy_name, None)
+
+        if errors:
+            raise errors[0]
 
 
     @log('Free')
@@ -233,22 +650,14 @@ class Memory:
         >>> mem.read(var)
         *error raised*
         """
+        var = as_variable(var)
         if not var:
             raise Exception("""Double free.""")
 
-        for var_name in var.var_names:
-            slave_id = Collector.get_slave_id(var_name)
-            self.comm.isend(var_name, dest=slave_id, tag=Tags.free)
-
-        for var_name in var.var_names:
-            slave_id = Collector.get_slave_id(var_name)
-
-            nb_freed = self.comm.recv(source=slave_id, tag=Tags.free)
-            # Remove any info related to @var_name while send is processing.
-            self.slaves_tracking[slave_id] -= nb_freed
-            self.list_tracking.pop(var_name, None)
-
+        self._free_copies([copy_name for var_name in var.var_names
+                           for copy_name in var.copies(var_name)])
         var.var_names = []
+        var.replicas = None
 
 
     @log('Map')
@@ -264,10 +673,15 @@ class Memory:
         >>> mem.read(var)
         [2, 3, 4]
         """
+        var = as_variable(var)
+        fun_dump = self.serializer.pack(dill.dumps(fun), 'map')
         for var_name in var.var_names:
-            slave_id = Collector.get_slave_id(var_name)
-            msg = (var_name, dill.dumps(fun))
-            self.comm.isend(msg, dest=slave_id, tag=Tags.map)
+            version = self._bump_version(var, var_name)
+            for copy_name in var.copies(var_name):
+                slave_id = Collector.get_slave_id(copy_name)
+                msg = (copy_name, fun_dump, version)
+                self._send(msg, dest=slave_id, tag=Tags.map, answer=False)
+                self.stale_slaves.add(slave_id)
 
 
     @log('Filter')
@@ -288,20 +702,47 @@ class Memory:
         >>> mem.read(var)
         [2]
         """
+        var = as_variable(var)
+        fun_dump = self.serializer.pack(dill.dumps(fun), 'filter')
+        for var_name in var.var_names:
+            version = self._bump_version(var, var_name)
+            for copy_name in var.copies(var_name):
+                slave_id = Collector.get_slave_id(copy_name)
+                msg = (copy_name, fun_dump, version)
+                self._send(msg, dest=slave_id, tag=Tags.filter)
+                self.stale_slaves.add(slave_id)
+
         to_remove = []
         for var_name in var.var_names:
-            slave_id = Collector.get_slave_id(var_name)
-            msg = (var_name, dill.dumps(fun))
-            self.comm.isend(msg, dest=slave_id, tag=Tags.filter)
+            # Every copy is filtered the same way as the primary one.
+            for copy_name in reversed(var.copies(var_name)):
+                slave_id = Collector.get_slave_id(copy_name)
+                diff_len, presence = self._recv(source=slave_id, tag=Tags.filter)
+                self.slaves_tracking[slave_id] -= diff_len
 
-            diff_len, presence = self.comm.recv(source=slave_id, tag=Tags.filter)
-            self.slaves_tracking[slave_id] -= diff_len
+            if var_name in self.list_tracking:
+                low_bound, high_bound = self.list_tracking[var_name]
+                self.list_tracking[var_name] = (low_bound, high_bound - diff_len)
 
             if not presence:
                 to_remove.append(var_name)
 
         for var_name in to_remove:
             var.var_names.remove(var_name)
+            if var.replicas is not None:
+                var.replicas.pop(var_name, None)
+            self.list_tracking.pop(var_name, None)
+            self.versions.pop(var_name, None)
+
+        # Shift the bounds of the remaining chunks so that they stay contiguous.
+        accumulated_amount = 0
+        for var_name in var.var_names:
+            if var_name in self.list_tracking:
+                low_bound, high_bound = self.list_tracking[var_name]
+                amount = high_bound - low_bound + 1
+                self.list_tracking[var_name] = (accumulated_amount,
+                                                accumulated_amount + amount - 1)
+                accumulated_amount += amount
 
 
     @log('Reduce')
@@ -317,16 +758,568 @@ class Memory:
         >>> mem.reduce(var, lambda x, y: x + y, 100)
         106
         """
-        slave_id_first = Collector.get_slave_id(var.var_names[0])
-        slave_id_last = Collector.get_slave_id(var.var_names[-1])
+        var = as_variable(var)
+        var_names = [self._pick_copy(var, var_name) for var_name in var.var_names]
+        slave_id_first = Collector.get_slave_id(var_names[0])
+        slave_id_last = Collector.get_slave_id(var_names[-1])
 
-        msg = (var.var_names, dill.dumps(fun), initial_value)
+        msg = (var_names, self.serializer.pack(dill.dumps(fun), 'reduce'),
+               initial_value)
 
-        self.comm.isend(msg, dest=slave_id_first, tag=Tags.reduce)
-        val = self.comm.recv(source=slave_id_last, tag=Tags.reduce)
+        self._send(msg, dest=slave_id_first, tag=Tags.reduce, answer=False)
+        val = self._recv(source=slave_id_last, tag=Tags.reduce)
         return val
 
 
+    def _key_slave_id(self, key):
+        """Slave hosting @key, which must be an `int` or a `str`: an equal key
+        of another type, like `1.0`, would be hosted by another slave."""
+        if not isinstance(key, int) and not isinstance(key, str):
+            raise ValueError("""Expecting either an `int` or a `str` key,
+                                not a `{}`""".format(type(key).__name__))
+
+        return Collector.get_key_slave_id(key, self.nb_slaves)
+
+
+    def _keys_by_slave(self, keys):
+        """Group the keys of a distributed dict by slave."""
+        keys_by_slave = collections.defaultdict(list)
+        for key in keys:
+            slave_id = self._key_slave_id(key)
+            keys_by_slave[slave_id].append(key)
+
+        return keys_by_slave
+
+
+    @log('Add dict')
+    def add_dict(self, mapping=None):
+        """Create a distributed dict, its keys are partitioned over the slaves
+        according to their hash.
+
+        mapping -- Initial items of the dict.
+
+        Ex:
+        >>> d = mem.add_dict({'a': 1})
+        >>> mem.dict_get(d, 'a')
+        1
+        """
+        d = DistributedDict('dict-{}'.format(self.dicts_counter))
+        self.dicts_counter += 1
+
+        if mapping:
+            self.dict_update_many(d, mapping)
+
+        return d
+
+
+    @log('Dict put')
+    def dict_put(self, d, key, value):
+        """Associate @value to @key in the distributed dict @d.
+
+        d     -- `DistributedDict` instance
+        key   -- Either an `int` or a `str`.
+        value -- Either an `int` of a `list` of `int`.
+
+        Ex:
+        >>> mem.dict_put(d, 'a', 42)
+        >>> mem.dict_get(d, 'a')
+        42
+        """
+        self.dict_update_many(d, {key: value})
+
+
+    @log('Dict update many')
+    def dict_update_many(self, d, mapping):
+        """Update the distributed dict @d with the items of @mapping.
+
+        A single message is sent to each slave hosting some of the keys.
+
+        Ex:
+        >>> mem.dict_update_many(d, {'a': 1, 'b': 2})
+        """
+        for value in mapping.values():
+            if not isinstance(value, int) and not isinstance(value, list):
+                raise ValueError("""Expecting either an `int` or a `list`,
+                                    not a `{}`""".format(type(value).__name__))
+
+        keys_by_slave = self._keys_by_slave(mapping)
+        if self.max_bytes_per_slave is not None:
+            # The items are admitted on the slaves hosting their keys.
+            self._refresh_usage()
+            for slave_id, keys in keys_by_slave.items():
+                nb_bytes = sum(item_footprint(key, mapping[key]) for key in keys)
+                if self.bytes_tracking[slave_id] + nb_bytes > self.max_bytes_per_slave:
+                    raise Exception("""Not enough memory for the dict!""")
+
+        for slave_id, keys in keys_by_slave.items():
+            items = {key: mapping[key] for key in keys}
+            self._send((d.dict_name, items), dest=slave_id,
+                       tag=Tags.dict_update, answer=False)
+            self.stale_slaves.add(slave_id)
+
+
+    @log('Dict get')
+    def dict_get(self, d, key, default=None):
+        """Returns the value associated to @key in the distributed dict @d, or
+        @default if @key is missing.
+
+        Ex:
+        >>> mem.dict_get(d, 'missing', 0)
+        0
+        """
+        return self.dict_get_many(d, [key]).get(key, default)
+
+
+    @log('Dict get many')
+    def dict_get_many(self, d, keys):
+        """Returns a `dict` of the items of @keys present in the distributed
+        dict @d.
+
+        A single message is sent to each slave hosting some of the keys.
+
+        Ex:
+        >>> mem.dict_get_many(d, ['a', 'b', 'missing'])
+        {'a': 1, 'b': 2}
+        """
+        keys_by_slave = self._keys_by_slave(keys)
+        for slave_id, slave_keys in keys_by_slave.items():
+            self._send((d.dict_name, slave_keys), dest=slave_id,
+                       tag=Tags.dict_get)
+
+        items = dict()
+        for slave_id in keys_by_slave:
+            items.update(self._recv(source=slave_id, tag=Tags.dict_get))
+
+        return items
+
+
+    @log('Dict delete')
+    def dict_delete(self, d, key):
+        """Delete @key from the distributed dict @d.
+
+        Returns whether @key was present.
+
+        Ex:
+        >>> mem.dict_delete(d, 'a')
+        True
+        """
+        slave_id = self._key_slave_id(key)
+        self._send((d.dict_name, [key]), dest=slave_id, tag=Tags.dict_delete)
+        self.stale_slaves.add(slave_id)
+
+        return self._recv(source=slave_id, tag=Tags.dict_delete) == 1
+
+
+    @log('Dict read')
+    def dict_read(self, d):
+        """Returns the whole distributed dict @d as a `dict`.
+
+        Ex:
+        >>> mem.dict_read(d)
+        {'a': 1, 'b': 2}
+        """
+        for slave_id in range(1, self.nb_slaves+1):
+            self._send((d.dict_name, None), dest=slave_id, tag=Tags.dict_get)
+
+        items = dict()
+        for slave_id in range(1, self.nb_slaves+1):
+            items.update(self._recv(source=slave_id, tag=Tags.dict_get))
+
+        return items
+
+
+    @log('Dict free')
+    def dict_free(self, d):
+        """Free the distributed dict @d on every slave.
+
+        Ex:
+        >>> mem.dict_free(d)
+        """
+        for slave_id in range(1, self.nb_slaves+1):
+            self._send((d.dict_name, None), dest=slave_id, tag=Tags.dict_delete)
+            self.stale_slaves.add(slave_id)
+
+        for slave_id in range(1, self.nb_slaves+1):
+            self._recv(source=slave_id, tag=Tags.dict_delete)
+
+
+    def _aggregate(self, var, fun, kind):
+        """Aggregate the variable @var into a new distributed dict.
+
+        Each slave aggregates its chunks then sends the partial results
+        directly to the slaves hosting their keys.
+        """
+        var = as_variable(var)
+        if not var:
+            raise ValueError("""@var is not allocated.""")
+
+        d = self.add_dict()
+
+        chunks = collections.defaultdict(list)
+        for position, var_name in enumerate(var.var_names):
+            copy_name = self._pick_copy(var, var_name)
+            chunks[Collector.get_slave_id(copy_name)].append((position, copy_name))
+
+        # Every slave takes part to the aggregation as it may host some keys.
+        fun_dump = self.serializer.pack(dill.dumps(fun), 'aggregate')
+        for slave_id in range(1, self.nb_slaves+1):
+            msg = (d.dict_name, chunks.get(slave_id, []), fun_dump, kind,
+                   self.max_bytes_per_slave is not None)
+            self._send(msg, dest=slave_id, tag=Tags.aggregate)
+            self.stale_slaves.add(slave_id)
+
+        # The size of the dict is only known once aggregated: it is freed if a
+        # slave exceeds its budget, or if a key is neither an `int` nor a `str`.
+        exceeded = False
+        error = None
+        for slave_id in range(1, self.nb_slaves+1):
+            nb_keys, nb_bytes = self._recv(source=slave_id, tag=Tags.aggregate)
+            if isinstance(nb_keys, Exception):
+                error = error or nb_keys
+            if self.max_bytes_per_slave is not None:
+                self.bytes_tracking[slave_id] = nb_bytes
+                self.stale_slaves.discard(slave_id)
+                exceeded = exceeded or nb_bytes > self.max_bytes_per_slave
+
+        if error is not None:
+            self.dict_free(d)
+            raise error
+        if exceeded:
+            self.dict_free(d)
+            raise Exception("""Not enough memory for the dict!""")
+
+        return d
+
+
+    @log('Count by')
+    def count_by(self, var, fun=None):
+        """Count the values of @var per key into a new distributed dict.
+
+        var -- `Variable` instance
+        fun -- Function returning the key of a value. The value itself is the
+               key if `None`.
+
+        Ex:
+        >>> var = mem.add([1, 2, 3, 4])
+        >>> d = mem.count_by(var, lambda x: x % 2)
+        >>> mem.dict_read(d)
+        {0: 2, 1: 2}
+        """
+        return self._aggregate(var, fun, 'count')
+
+
+    @log('Group by')
+    def group_by(self, var, fun):
+        """Group the values of @var per key into a new distributed dict.
+
+        The values of a group keep their order in @var.
+
+        var -- `Variable` instance
+        fun -- Function returning the key of a value.
+
+        Ex:
+        >>> var = mem.add([1, 2, 3, 4])
+        >>> d = mem.group_by(var, lambda x: x % 2)
+        >>> mem.dict_read(d)
+        {0: [2, 4], 1: [1, 3]}
+        """
+        return self._aggregate(var, fun, 'group')
+
+
+    def _summarize(self, var, kind, arg=None):
+        """Returns the summaries of @var computed by each slave hosting it.
+
+        See `Collector.summarize`.
+        """
+        var = as_variable(var)
+        if not var:
+            raise ValueError("""@var is not allocated.""")
+
+        chunks = collections.defaultdict(list)
+        for var_name in var.var_names:
+            copy_name = self._pick_copy(var, var_name)
+            chunks[Collector.get_slave_id(copy_name)].append(copy_name)
+
+        for slave_id, var_names in chunks.items():
+            self._send((var_names, kind, arg), dest=slave_id,
+                       tag=Tags.summarize)
+
+        return [self._recv(source=slave_id, tag=Tags.summarize)
+                for slave_id in chunks]
+
+
+    @log('Top k')
+    def topk(self, var, k):
+        """Returns the @k largest values of @var in decreasing order.
+
+        Each slave only sends its own @k largest values.
+
+        var -- `Variable` instance
+        k   -- Amount of values.
+
+        Ex:
+        >>> var = mem.add([4, 1, 3, 2])
+        >>> mem.topk(var, 2)
+        [4, 3]
+        """
+        summaries = self._summarize(var, 'topk', k)
+        return heapq.nlargest(k, itertools.chain.from_iterable(summaries))
+
+
+    @log('Quantiles')
+    def quantiles(self, var, qs, resolution=1000):
+        """Returns the nearest-rank quantiles @qs of @var.
+
+        Each slave sends at most @resolution values evenly spaced in its sorted
+        values, the quantiles are exact if each slave hosts less values.
+
+        var        -- `Variable` instance
+        qs         -- `list` of quantiles between 0 and 1.
+        resolution -- Maximum amount of values sent by a slave.
+
+        Ex:
+        >>> var = mem.add(list(range(101)))
+        >>> mem.quantiles(var, [0.5, 0.99])
+        [50, 99]
+        """
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError("""Quantiles must be between 0 and 1,
+                                    not {}.""".format(q))
+
+        if resolution < 2:
+            raise ValueError("""@resolution must be at least 2,
+                                not {}.""".format(resolution))
+
+        summaries = self._summarize(var, 'sketch', resolution)
+        samples = sorted(itertools.chain.from_iterable(s for s, _ in summaries))
+        nb_values = sum(n for _, n in summaries)
+
+        results = []
+        for q in qs:
+            # The smallest value with at least q * n values up to it. The
+            # product is rounded first as 0.07 * 100 is 7.000000000000001.
+            rank = max(0, math.ceil(round(q * nb_values, 9)) - 1)
+            accumulated_weight = 0
+            for value, weight in samples:
+                accumulated_weight += weight
+                if accumulated_weight > rank:
+                    break
+            results.append(value)
+
+        return results
+
+
+    @log('Histogram')
+    def histogram(self, var, bins):
+        """Returns the counts of values of @var per bin, and the bins' edges.
+
+        Each slave only sends its own counts. As with numpy, every bin but the
+        last one excludes its right edge.
+
+        var  -- `Variable` instance
+        bins -- Either the amount of bins of equal width between the minimum
+                and maximum values, or the `list` of the bins' edges.
+
+        Ex:
+        >>> var = mem.add([1, 2, 2, 3, 4])
+        >>> mem.histogram(var, [0, 2, 4])
+        ([1, 4], [0, 2, 4])
+        """
+        if isinstance(bins, int):
+            if bins < 1:
+                raise ValueError("""@bins must be positive, not {}.""".format(bins))
+
+            ranges = [r for r in self._summarize(var, 'range') if r[2] > 0]
+            low = min(r[0] for r in ranges)
+            high = max(r[1] for r in ranges)
+            if low == high:
+                high = low + 1
+            edges = [low + i * (high - low) / bins for i in range(bins)] + [high]
+        else:
+            edges = list(bins)
+            if len(edges) < 2 or edges != sorted(edges):
+                raise ValueError("""@bins must be at least two increasing
+                                    edges.""")
+
+        counts = [0] * (len(edges) - 1)
+        for summary in self._summarize(var, 'histogram', edges):
+            counts = [c + s for c, s in zip(counts, summary)]
+
+        return counts, edges
+
+
+    @log('Save')
+    def save(self, var, path):
+        """Export the variable @var to the binary file @path.
+
+        Every slave writes its own chunks at their offset in the file with
+        collective MPI-IO, thus the bandwidth scales with the number of slaves.
+        The file holds the raw values as native 64-bit signed integers, a
+        `ValueError` is raised and nothing is written if a value does not fit.
+
+        var  -- `Variable` instance
+        path -- Path of the file, must be reachable by every host.
+
+        Ex:
+        >>> var = mem.add([1, 2, 3])
+        >>> mem.save(var, 'var.bin')
+        """
+        var = as_variable(var)
+        if not var:
+            raise ValueError("""@var is not allocated.""")
+
+        itemsize = array.array(FILE_TYPECODE).itemsize
+        chunks = collections.defaultdict(list)
+        total_size = 0
+        for var_name in var.var_names:
+            if var.var_type == int:
+                low_bound, high_bound = 0, 0
+            else:
+                low_bound, high_bound = self.list_tracking[var_name]
+            slave_id = Collector.get_slave_id(var_name)
+            chunks[slave_id].append((var_name, low_bound * itemsize))
+            total_size = max(total_size, (high_bound + 1) * itemsize)
+
+        nb_rounds = max(len(c) for c in chunks.values())
+        for slave_id in range(1, self.nb_slaves+1):
+            msg = (path, chunks.get(slave_id, []), nb_rounds, total_size)
+            self._send(msg, dest=slave_id, tag=Tags.save, answer=False)
+
+        # Every processus reports whether its values fit 64 bits.
+        errors = [error for error in self.comm.allgather(None) if error]
+        if errors:
+            raise ValueError("""Only 64-bit integers can be saved:
+                                {}.""".format(errors[0]))
+
+        # The Master takes part to the collective calls without writing.
+        fh = MPI.File.Open(self.comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+        fh.Set_size(total_size)
+        for _ in range(nb_rounds):
+            fh.Write_at_all(0, array.array(FILE_TYPECODE))
+        fh.Close()
+
+
+    @log('Load')
+    def load(self, path):
+        """Import the binary file @path, written by `save`, as a new list.
+
+        Every selected slave reads its own chunk with collective MPI-IO.
+
+        path -- Path of the file, must be reachable by every host.
+
+        Ex:
+        >>> var = mem.load('var.bin')
+        >>> mem.read(var)
+        [1, 2, 3]
+        """
+        itemsize = array.array(FILE_TYPECODE).itemsize
+        var_size, remainder = divmod(os.path.getsize(path), itemsize)
+        if var_size == 0:
+            raise ValueError("""The file {} is empty.""".format(path))
+        if remainder != 0:
+            raise ValueError("""The size of the file {} is not a multiple of
+                                {} bytes.""".format(path, itemsize))
+
+        selected_slaves = self._select_slaves(var_size, LOADED_ELEMENT_SIZE)
+
+        chunks = collections.defaultdict(list)
+        tmp_list_tracking = []
+        accumulated_amount = 0
+        for slave_id, amount in selected_slaves:
+            chunks[slave_id].append((accumulated_amount * itemsize, amount))
+            tmp_list_tracking.append((accumulated_amount,
+                                      accumulated_amount + amount - 1))
+            self._reserve(slave_id, amount, amount * LOADED_ELEMENT_SIZE)
+            # The bytes are estimated until the next report.
+            self.stale_slaves.add(slave_id)
+            accumulated_amount += amount
+
+        nb_rounds = max(len(c) for c in chunks.values())
+        for slave_id in range(1, self.nb_slaves+1):
+            msg = (path, chunks.get(slave_id, []), nb_rounds)
+            self._send(msg, dest=slave_id, tag=Tags.load,
+                       answer=slave_id in chunks)
+
+        fh = MPI.File.Open(self.comm, path, MPI.MODE_RDONLY)
+        for _ in range(nb_rounds):
+            fh.Read_at_all(0, array.array(FILE_TYPECODE))
+        fh.Close()
+
+        # Gathering the ids in the order of the chunks
+        slaves_names = dict()
+        for slave_id in chunks:
+            slaves_names[slave_id] = self._recv(source=slave_id, tag=Tags.load)
+
+        var_names = []
+        for i, (slave_id, _) in enumerate(selected_slaves):
+            var_name = slaves_names[slave_id].pop(0)
+            var_names.append(var_name)
+            self.list_tracking[var_name] = tmp_list_tracking[i]
+
+        return Variable(var_names, list)
+
+
+    @log('Stats')
+    def stats(self):
+        """Returns the metrics of every processus and their sum.
+
+        Per processus: the count, total time and latency histogram (bucket's
+        upper bound in microseconds -> count) per operation, the bytes sent and
+        received, the time spent waiting for messages, in the queues, computing
+        and serializing.
+
+        Ex:
+        >>> mem = init_memory(max_per_slave=100, metrics=True)
+        >>> stats = mem.stats()
+        >>> stats['total']['bytes_sent']
+        1337
+        >>> stats['ranks'][1]['ops']['read_var']['count']
+        42
+        """
+        if not self.metrics.enabled:
+            raise ValueError("""The metrics are disabled.""")
+
+        for slave_id in range(1, self.nb_slaves+1):
+            self._send(None, dest=slave_id, tag=Tags.stats)
+
+        ranks = {0: self.metrics.summary()}
+        for slave_id in range(1, self.nb_slaves+1):
+            ranks[slave_id] = self._recv(source=slave_id, tag=Tags.stats)
+
+        return {'total': Metrics.merge(ranks.values()), 'ranks': ranks}
+
+
+    @log('Dump trace')
+    def dump_trace(self, path):
+        """Write the merged timeline of every processus to the file @path.
+
+        The JSON file follows the Chrome trace format, readable by
+        `chrome://tracing` or Perfetto.
+
+        Ex:
+        >>> mem = init_memory(max_per_slave=100, trace=True)
+        >>> mem.dump_trace('trace.json')
+        """
+        if not self.metrics.trace:
+            raise ValueError("""The trace is disabled.""")
+
+        for slave_id in range(1, self.nb_slaves+1):
+            self._send(None, dest=slave_id, tag=Tags.trace)
+
+        events = list(self.metrics.events)
+        for slave_id in range(1, self.nb_slaves+1):
+            events.extend(self._recv(source=slave_id, tag=Tags.trace))
+
+        for rank in range(self.nb_slaves+1):
+            name = 'Master' if rank == 0 else 'Slave-{}'.format(rank)
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': rank,
+                           'args': {'name': name}})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
     @log('Quit')
     def quit(self):
         """Close each slave then itself.
@@ -336,7 +1329,8 @@ class Memory:
         """
         pending = []
         for slave_id in range(1, self.nb_slaves+1):
-            req = self.comm.isend(0, dest=slave_id, tag=Tags.quit)
+            req = self.comm.isend(self.metrics.envelope(0), dest=slave_id,
+                                  tag=Tags.quit)
             pending.append(req)
 
         for req in pending:
@@ -0,0 +1,145 @@
+"""This module implements the metrics recorded by the Master and the
+Collectors, and their timeline in the Chrome trace format."""
+
+import collections
+import math
+import pickle
+
+from mpi4py import MPI
+
+
+def message_size(msg):
+    """Amount of bytes of @msg once pickled, out-of-band buffers included."""
+    buffers = []
+    size = len(pickle.dumps(msg, protocol=5, buffer_callback=buffers.append))
+    return size + sum(buf.raw().nbytes for buf in buffers)
+
+
+def histogram_bucket(duration):
+    """Upper bound, in microseconds, of the power of two bucket of @duration."""
+    microseconds = duration * 1e6
+    if microseconds <= 1:
+        return 1
+    return 2 ** math.ceil(math.log2(microseconds))
+
+
+class Metrics:
+    """Per-operation counts and latencies, bytes exchanged and time spent per
+    phase by a processus.
+
+    Every message is sent in an envelope holding its sending time and its
+    size, the receiver deduces the time it has waited in its queue. The times
+    are relative to a barrier shared by every processus at the initialization.
+    """
+    def __init__(self, comm, enabled=False, trace=False):
+        """Init a `Metrics`.
+
+        comm    -- Communicator of the distributed memory.
+        enabled -- Whether metrics are recorded.
+        trace   -- Whether the timeline events are kept.
+
+        Every processus must create its `Metrics` with the same arguments.
+        """
+        self.rank = comm.Get_rank()
+        self.enabled = enabled or trace
+        self.trace = trace
+
+        self.ops = collections.defaultdict(lambda: {
+            'count': 0, 'total_time': 0., 'histogram': collections.Counter()})
+        self.times = collections.defaultdict(float)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.events = []
+
+        if self.enabled:
+            comm.Barrier()
+        self.origin = MPI.Wtime()
+
+
+    def now(self):
+        return MPI.Wtime() - self.origin
+
+
+    def envelope(self, msg):
+        """Wrap @msg before sending it.
+
+        Its size is only measured here and carried to the receiver.
+        """
+        if not self.enabled:
+            return None, 0, msg
+
+        size = message_size(msg)
+        self.bytes_sent += size
+        return self.now(), size, msg
+
+
+    def open(self, envelope):
+        """Unwrap a received @envelope."""
+        sent_at, size, msg = envelope
+        if sent_at is not None:
+            self.bytes_received += size
+            self.times['queue_wait_time'] += max(0., self.now() - sent_at)
+
+        return msg
+
+
+    def record(self, op, start, category='op'):
+        """Record the operation @op started at @start and ending now."""
+        end = self.now()
+        stats = self.ops[op]
+        stats['count'] += 1
+        stats['total_time'] += end - start
+        stats['histogram'][histogram_bucket(end - start)] += 1
+        self.add_event(op, start, end, category)
+
+
+    def add_time(self, phase, start, event=None):
+        """Add the time from @start to now to the @phase."""
+        end = self.now()
+        self.times[phase] += end - start
+        if event is not None:
+            self.add_event(event, start, end, phase)
+
+
+    def add_event(self, name, start, end, category):
+        if self.trace:
+            self.events.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': self.rank,
+                'tid': 0, 'ts': start * 1e6, 'dur': (end - start) * 1e6})
+
+
+    def summary(self):
+        return {
+            'ops': {op: {'count': s['count'], 'total_time': s['total_time'],
+                         'histogram': dict(s['histogram'])}
+                    for op, s in self.ops.items()},
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'compute_time': self.times['compute_time'],
+            'wait_time': self.times['wait_time'],
+            'queue_wait_time': self.times['queue_wait_time'],
+            'serialize_time': self.times['serialize_time'],
+        }
+
+
+    @classmethod
+    def merge(cls, summaries):
+        """Sum the @summaries of several processus."""
+        total = {'ops': dict(), 'bytes_sent': 0, 'bytes_received': 0,
+                 'compute_time': 0., 'wait_time': 0., 'queue_wait_time': 0.,
+                 'serialize_time': 0.}
+        for summary in summaries:
+            for op, s in summary['ops'].items():
+                op_total = total['ops'].setdefault(op, {
+                    'count': 0, 'total_time': 0., 'histogram': dict()})
+                op_total['count'] += s['count']
+                op_total['total_time'] += s['total_time']
+                for bucket, count in s['histogram'].items():
+                    op_total['histogram'][bucket] =\
+                        op_total['histogram'].get(bucket, 0) + count
+
+            for k, v in summary.items():
+                if k != 'ops':
+                    total[k] += v
+
+        return total
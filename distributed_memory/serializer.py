@@ -0,0 +1,249 @@
+"""This module implements the packing of the values and functions exchanged
+between the Master and the Collectors."""
+
+import array
+import collections
+import itertools
+import operator
+import pickle
+import zlib
+
+
+# Lists shorter than this are sent as is, through the usual pickle.
+MIN_PACKED_LENGTH = 64
+# Packed data bigger than this amount of bytes are delta-encoded or compressed.
+COMPRESSION_THRESHOLD = 4096
+# Amount of values, then of bytes, tried before delta-encoding, then
+# compressing, the whole data.
+DELTA_SAMPLE = 1024
+COMPRESSION_SAMPLE = 65536
+# The data are compressed only if their sample shrinks at least to this ratio.
+COMPRESSION_RATIO = 0.9
+# Typecodes tried from the narrowest to the widest.
+TYPECODES = ('b', 'h', 'i', 'q')
+
+
+class Payload:
+    """A `list` of `int` packed into an array, or a compressed `bytes`.
+
+    With the pickle protocol 5, the packed data are sent out-of-band: they are
+    not copied into the pickled message.
+    """
+    def __init__(self, data, typecode, length, delta, compressed, saved,
+                 first=0):
+        self.data = data
+        self.typecode = typecode
+        self.length = length
+        self.delta = delta
+        self.compressed = compressed
+        self.saved = saved
+        self.first = first # First value, kept aside of the deltas
+
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            data = pickle.PickleBuffer(self.data)
+        else:
+            data = bytes(self.data)
+
+        return (Payload, (data, self.typecode, self.length, self.delta,
+                          self.compressed, self.saved, self.first))
+
+
+    def __len__(self):
+        return memoryview(self.data).nbytes
+
+
+def narrowest_typecode(low, high):
+    """Narrowest typecode of the integers between @low and @high.
+
+    Raises an `OverflowError` if an integer does not fit 64 bits.
+    """
+    for typecode in TYPECODES:
+        bound = 2 ** (8 * array.array(typecode).itemsize - 1)
+        if -bound <= low and high < bound:
+            return typecode
+
+    raise OverflowError("""{} does not fit 64 bits.""".format(
+        low if -low > high else high))
+
+
+def narrowest_array(values):
+    """Pack the `int` @values into the narrowest array possible.
+
+    Raises an `OverflowError` if an integer does not fit 64 bits, and a
+    `TypeError` if a value is not an integer.
+    """
+    return array.array(narrowest_typecode(min(values), max(values)), values)
+
+
+def deltas(values):
+    return list(map(operator.sub, itertools.islice(values, 1, None), values))
+
+
+def pickled_size(length, low, high):
+    """Estimated amount of bytes of @length `int` between @low and @high once
+    pickled: an opcode per integer, then its bytes."""
+    if 0 <= low and high < 2 ** 8:
+        return 2 * length
+    elif 0 <= low and high < 2 ** 16:
+        return 3 * length
+    elif -2 ** 31 <= low and high < 2 ** 31:
+        return 5 * length
+    return (2 + (max(high, -low - 1).bit_length() + 8) // 8) * length
+
+
+class Serializer:
+    """Pack the values before sending them and unpack them once received.
+
+    Keep track, per operation, of the bytes that would have been pickled and
+    of the bytes actually sent.
+    """
+    def __init__(self, compression_threshold=COMPRESSION_THRESHOLD, metrics=None):
+        """Init a `Serializer`.
+
+        compression_threshold -- Minimum amount of bytes to delta-encode or to
+                                 compress. `None` disables both.
+        metrics               -- `Metrics` recording the serialization time.
+        """
+        self.compression_threshold = compression_threshold
+        self.metrics = metrics
+        self.stats = collections.defaultdict(lambda: [0, 0])
+
+
+    def pack(self, value, op=None):
+        """Pack @value if it is worth it, otherwise returns it unchanged.
+
+        value -- A `list` of `int` or the `bytes` of a dumped function.
+        op    -- Operation name under which the bytes saved are recorded.
+        """
+        start = self._start()
+        if isinstance(value, bytes):
+            payload = self._pack_bytes(value)
+        elif isinstance(value, list) and len(value) >= MIN_PACKED_LENGTH:
+            payload = self._pack_list(value)
+        else:
+            payload = None
+
+        if payload is None:
+            return value
+
+        self.record(op, payload)
+        self._stop(start, 'pack')
+        return payload
+
+
+    def unpack(self, value, op=None):
+        """Returns the original value of a `Payload`, other values unchanged."""
+        if not isinstance(value, Payload):
+            return value
+
+        start = self._start()
+        self.record(op, value)
+        data = value.data
+        if value.compressed:
+            data = zlib.decompress(data)
+        if value.typecode is None:
+            self._stop(start, 'unpack')
+            return bytes(data)
+
+        values = array.array(value.typecode)
+        values.frombytes(memoryview(data).cast('B'))
+        if value.delta:
+            values = list(itertools.accumulate(values, initial=value.first))
+        else:
+            values = values.tolist()
+
+        self._stop(start, 'unpack')
+        return values
+
+
+    def _start(self):
+        if self.metrics is not None and self.metrics.enabled:
+            return self.metrics.now()
+
+
+    def _stop(self, start, event):
+        if start is not None:
+            self.metrics.add_time('serialize_time', start, event)
+
+
+    def record(self, op, payload):
+        if op is None:
+            return
+
+        self.stats[op][0] += len(payload) + payload.saved
+        self.stats[op][1] += len(payload)
+
+
+    def bytes_saved(self):
+        """Returns the amount of bytes saved per operation."""
+        return {op: pickled - sent for op, (pickled, sent) in self.stats.items()}
+
+
+    def _pack_bytes(self, value):
+        if self.compression_threshold is None or\
+           len(value) < self.compression_threshold:
+            return None
+
+        data = zlib.compress(value, 1)
+        if len(data) >= len(value):
+            return None
+
+        return Payload(data, None, len(value), False, True,
+                       len(value) - len(data))
+
+
+    def _pack_list(self, value):
+        try:
+            low, high = min(value), max(value)
+            typecode = narrowest_typecode(low, high)
+        except (OverflowError, TypeError):
+            return None
+        itemsize = array.array(typecode).itemsize
+
+        # Sorted or slowly varying lists have small differences: they are only
+        # computed if the first ones are narrower than the values.
+        values, delta, first = value, False, 0
+        if itemsize > 1 and self._worth_packing(len(value) * itemsize) and\
+           self._narrower(deltas(value[:DELTA_SAMPLE]), itemsize) is not None:
+            value_deltas = deltas(value)
+            delta_typecode = self._narrower(value_deltas, itemsize)
+            if delta_typecode is not None:
+                values, delta, first = value_deltas, True, value[0]
+                typecode = delta_typecode
+
+        try:
+            packed = array.array(typecode, values)
+        except TypeError:
+            return None
+
+        data, compressed = packed, False
+        nbytes = len(packed) * packed.itemsize
+        if self._worth_packing(nbytes):
+            sample = memoryview(packed).cast('B')[:COMPRESSION_SAMPLE]
+            if len(zlib.compress(sample, 1)) <= COMPRESSION_RATIO * len(sample):
+                compressed_data = zlib.compress(packed, 1)
+                if len(compressed_data) < nbytes:
+                    data, compressed = compressed_data, True
+
+        sent_size = memoryview(data).nbytes
+        return Payload(data, packed.typecode, len(value), delta, compressed,
+                       pickled_size(len(value), low, high) - sent_size, first)
+
+
+    def _worth_packing(self, nbytes):
+        """Whether @nbytes are enough to delta-encode or compress them."""
+        return self.compression_threshold is not None and\
+            nbytes >= self.compression_threshold
+
+
+    @staticmethod
+    def _narrower(values, itemsize):
+        """Typecode of @values if narrower than @itemsize, `None` otherwise."""
+        try:
+            typecode = narrowest_typecode(min(values), max(values))
+        except OverflowError:
+            return None
+        if array.array(typecode).itemsize < itemsize:
+            return typecode
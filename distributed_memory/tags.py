@@ -10,6 +10,18 @@ class Tags:
     map = 6
     reduce = 7
     filter = 8
+    save = 9
+    load = 10
+    dict_update = 11
+    dict_get = 12
+    dict_delete = 13
+    aggregate = 14
+    dict_merge = 15
+    stats = 16
+    trace = 17
+    alloc_many = 18
+    summarize = 19
+    usage = 20
 
     @classmethod
     def name(cls, i):
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 
+import array
+import json
+import os
 import random
+import sys
+import tempfile
+import time
 
 import distributed_memory as dm
+from distributed_memory.serializer import Serializer, Payload
 
 mem = None
 
@@ -180,6 +187,524 @@ def test_filter_free_big():
     assert len(var.var_names) == 0
 
 
+@test
+def test_save_load_int():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_int.bin')
+    var = mem.add(42)
+    mem.save(var, path)
+    mem.free(var)
+    loaded = mem.load(path)
+    assert mem.read(loaded) == [42]
+    mem.free(loaded)
+    os.remove(path)
+
+
+@test
+def test_save_load_big_list():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_list.bin')
+    var = mem.add(list(range(15)))
+    mem.save(var, path)
+    assert os.path.getsize(path) == 15 * 8
+    mem.free(var)
+    loaded = mem.load(path)
+    assert mem.read(loaded) == list(range(15))
+    mem.free(loaded)
+    os.remove(path)
+
+
+@test
+def test_save_after_filter():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_filter.bin')
+    var = mem.add(list(range(15)))
+    mem.filter(var, lambda x: x % 3 == 0)
+    mem.save(var, path)
+    mem.free(var)
+    loaded = mem.load(path)
+    assert mem.read(loaded) == list(range(0, 15, 3))
+    mem.free(loaded)
+    os.remove(path)
+
+
+@test
+def test_save_big_int():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_save_big_int.bin')
+    var = mem.add([1, 2 ** 70, 3])
+    try:
+        mem.save(var, path)
+        assert False, 'A value does not fit 64 bits'
+    except ValueError:
+        pass
+    assert not os.path.exists(path)
+    mem.map(var, lambda x: x % 2 ** 60)
+    mem.save(var, path)
+    mem.free(var)
+    var = mem.load(path)
+    assert mem.read(var) == [1, 2 ** 70 % 2 ** 60, 3]
+    mem.free(var)
+    os.remove(path)
+
+
+@test
+def test_load_bad_size():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_bad_size.bin')
+    for size in [0, 12]:
+        with open(path, 'wb') as f:
+            f.write(bytes(size))
+        try:
+            mem.load(path)
+            assert False, 'A file of {} bytes must be refused'.format(size)
+        except ValueError:
+            pass
+    os.remove(path)
+
+@test
+def test_replication_add_free():
+    var = mem.add(list(range(5)), replication=2)
+    assert len(var.replicas[var.var_names[0]]) == 1
+    assert mem.read(var) == list(range(5))
+    mem.free(var)
+    assert not var
+    assert all(v == 0 for v in mem.slaves_tracking.values())
+
+
+@test
+def test_replication_capacity():
+    tracking = dict(mem.slaves_tracking)
+    try:
+        mem.add(list(range(10 * mem.nb_slaves)), replication=2)
+        assert False, 'The replicas exceed the capacity'
+    except Exception as e:
+        assert 'Not enough memory' in str(e)
+    assert dict(mem.slaves_tracking) == tracking
+
+    var = mem.add(list(range(5 * mem.nb_slaves)), replication=2)
+    assert max(mem.slaves_tracking.values()) <= 10
+    assert mem.read(var) == list(range(5 * mem.nb_slaves))
+    mem.free(var)
+
+@test
+def test_replication_reads_spread():
+    var = mem.add(list(range(5)), replication=2)
+    hosts = {dm.collector.Collector.get_slave_id(copy_name)
+             for var_name in var.var_names
+             for copy_name in var.copies(var_name)}
+    assert len(hosts) == 2
+    before = dict(mem.slaves_reads)
+    for _ in range(10):
+        assert mem.read(var) == list(range(5))
+    assert all(mem.slaves_reads[slave_id] > before.get(slave_id, 0)
+               for slave_id in hosts)
+    mem.free(var)
+
+
+@test
+def test_replication_writes():
+    var = mem.add(list(range(5)), replication=2)
+    assert mem.modify(var, 41, index=3)
+    mem.map(var, lambda x: x + 1)
+    mem.filter(var, lambda x: x % 2 == 0)
+    for _ in range(4):
+        assert mem.read(var) == [2, 42]
+    assert mem.reduce(var, lambda x, y: x + y, 0) == 44
+    mem.free(var)
+    assert all(v == 0 for v in mem.slaves_tracking.values())
+
+
+@test
+def test_replication_refused():
+    var = mem.add(list(range(5)), replication=2)
+    primary = var.var_names[0]
+    replica = var.replicas[primary][0]
+    assert mem.modify(var, 10, index=0)
+    middle = time.time()
+    # A write older than the last one is refused by every copy.
+    mem.clock = lambda: middle - 60
+    try:
+        assert not mem.modify(var, 12, index=2)
+    finally:
+        mem.clock = time.time
+    assert var.copies(primary) == [primary, replica]
+    time.sleep(0.01)
+    # A later write on the replica alone, the next write is refused there.
+    view = dm.memory.Variable([replica], list)
+    assert mem._modify_copies(view, replica, 10, 0)
+
+    mem.clock = lambda: middle
+    try:
+        assert mem.modify(var, 11, index=1)
+    finally:
+        mem.clock = time.time
+    slave_id = dm.collector.Collector.get_slave_id(replica)
+    assert var.copies(primary) == [primary]
+    assert mem.slaves_tracking[slave_id] == 0
+    for _ in range(4):
+        assert mem.read(var) == [10, 11, 2, 3, 4]
+    mem.free(var)
+
+
+@test
+def test_replication_int():
+    var = mem.add(42, replication=2)
+    assert mem.modify(var, 1337)
+    for _ in range(4):
+        assert mem.read(var) == 1337
+    mem.free(var)
+
+
+@test
+def test_serializer_pack_unpack():
+    serializer = Serializer(compression_threshold=1024)
+    for original in [list(range(1000)), [7] * 100, list(range(500, -500, -3)),
+                     [2 ** 40 + i for i in range(100)], [2 ** 70] * 100]:
+        packed = serializer.pack(original, 'test')
+        assert serializer.unpack(packed) == original
+    assert serializer.bytes_saved()['test'] > 0
+
+
+@test
+def test_serializer_delta():
+    serializer = Serializer(compression_threshold=1024)
+    original = [2 ** 40 + i for i in range(1000)]
+    packed = serializer.pack(original)
+    assert packed.delta and packed.typecode == 'b'
+    assert serializer.unpack(packed) == original
+    packed = Serializer(compression_threshold=None).pack(original)
+    assert not packed.delta and not packed.compressed
+    assert serializer.unpack(packed) == original
+    assert serializer.pack([1.5] * 100) == [1.5] * 100
+
+@test
+def test_serializer_small_values():
+    serializer = Serializer()
+    assert serializer.pack([1, 2, 3]) == [1, 2, 3]
+    assert serializer.pack(42) == 42
+    assert serializer.pack(b'fun') == b'fun'
+    assert not isinstance(serializer.pack([2 ** 70] * 100), Payload)
+
+
+@test
+def test_serializer_compress_fun():
+    serializer = Serializer(compression_threshold=1024)
+    dump = bytes(4096)
+    packed = serializer.pack(dump, 'map')
+    assert isinstance(packed, Payload) and packed.compressed
+    assert serializer.unpack(packed) == dump
+
+
+@test
+def test_dict_put_get():
+    d = mem.add_dict()
+    mem.dict_put(d, 'a', 42)
+    mem.dict_put(d, 7, [1, 2, 3])
+    assert mem.dict_get(d, 'a') == 42
+    assert mem.dict_get(d, 7) == [1, 2, 3]
+    assert mem.dict_get(d, 'missing', 0) == 0
+    for key in [1.0, (1,)]:
+        try:
+            mem.dict_put(d, key, 1)
+            assert False, 'Only `int` and `str` keys are allowed'
+        except ValueError:
+            pass
+    mem.dict_free(d)
+    assert not mem.dict_delete(d, 'a')
+    assert all(not r['dicts'] for r in mem.usage().values())
+    assert mem.dict_read(d) == {}
+
+
+@test
+def test_dict_many():
+    original = {i: i ** 2 for i in range(20)}
+    original.update({str(i): i for i in range(20)})
+    d = mem.add_dict(original)
+    assert mem.dict_read(d) == original
+    assert mem.dict_get_many(d, [1, '2', 'missing']) == {1: 1, '2': 2}
+    assert mem.dict_delete(d, 3)
+    assert not mem.dict_delete(d, 3)
+    original.pop(3)
+    assert mem.dict_read(d) == original
+    mem.dict_free(d)
+
+
+@test
+def test_count_by():
+    var = mem.add(list(range(15)))
+    d = mem.count_by(var, lambda x: x % 3)
+    assert mem.dict_read(d) == {0: 5, 1: 5, 2: 5}
+    mem.dict_free(d)
+    mem.filter(var, lambda x: x < 4)
+    d = mem.count_by(var)
+    assert mem.dict_read(d) == {0: 1, 1: 1, 2: 1, 3: 1}
+    mem.dict_free(d)
+    mem.free(var)
+
+
+@test
+def test_group_by():
+    var = mem.add(list(range(15)))
+    d = mem.group_by(var, lambda x: 'even' if x % 2 == 0 else 'odd')
+    assert mem.dict_get(d, 'even') == list(range(0, 15, 2))
+    assert mem.dict_get(d, 'odd') == list(range(1, 15, 2))
+    mem.dict_free(d)
+    mem.free(var)
+
+
+@test
+def test_group_by_bad_key():
+    var = mem.add(list(range(15)))
+    try:
+        mem.group_by(var, lambda x: x / 2)
+        assert False, 'A float key must be refused'
+    except ValueError:
+        pass
+    assert all(not r['dicts'] for r in mem.usage().values())
+    d = mem.count_by(var, lambda x: x % 2)
+    assert mem.dict_read(d) == {0: 8, 1: 7}
+    mem.dict_free(d)
+    mem.free(var)
+
+
+@test
+def test_stats():
+    if not mem.metrics.enabled:
+        try:
+            mem.stats()
+            assert False, 'The metrics are disabled'
+        except ValueError:
+            return
+
+    var = mem.add(list(range(15)))
+    try:
+        mem.read(var)
+        stats = mem.stats()
+        assert set(stats['ranks']) == set(range(mem.nb_slaves + 1))
+        assert stats['ranks'][0]['ops']['read']['count'] > 0
+        assert stats['total']['ops']['read_var']['count'] > 0
+        assert stats['total']['bytes_sent'] > 0
+        assert stats['total']['bytes_received'] == stats['total']['bytes_sent']
+        assert stats['total']['compute_time'] > 0
+        assert stats['total']['bytes_sent'] == sum(
+            s['bytes_sent'] for s in stats['ranks'].values())
+    finally:
+        mem.free(var)
+
+
+@test
+def test_dump_trace():
+    path = os.path.join(tempfile.gettempdir(), 'dm_test_trace.json')
+    if not mem.metrics.trace:
+        try:
+            mem.dump_trace(path)
+            assert False, 'The trace is disabled'
+        except ValueError:
+            return
+
+    var = mem.add(list(range(5)))
+    try:
+        mem.map(var, lambda x: x + 1)
+        mem.read(var)
+        mem.dump_trace(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert {e['pid'] for e in events} == set(range(mem.nb_slaves + 1))
+        assert any(e['name'] == 'map' and e['cat'] == 'compute_time'
+                   for e in events)
+    finally:
+        mem.free(var)
+    os.remove(path)
+
+
+@test
+def test_add_many():
+    variables = mem.add_many(list(range(12)))
+    assert isinstance(variables, array.array) and len(variables) == 12
+    assert [mem.read(var) for var in variables] == list(range(12))
+    assert mem.modify(variables[3], 1337)
+    assert mem.read(variables[3]) == 1337
+    mem.map(variables[0], lambda x: x + 100)
+    assert mem.read(variables[0]) == 100
+    for var in variables:
+        mem.free(var)
+    assert all(v == 0 for v in mem.slaves_tracking.values())
+
+
+@test
+def test_slot_reuse():
+    var = mem.add(42)
+    var_name = var.var_names[0]
+    mem.free(var)
+    var = mem.add(1337)
+    # Same slot, next generation
+    slot, generation = dm.collector.handle_slot(var.var_names[0])
+    assert (slot, generation) == (dm.collector.handle_slot(var_name)[0],
+                                  dm.collector.handle_slot(var_name)[1] + 1)
+    assert mem.read(var) == 1337
+    mem.free(var)
+
+
+@test
+def test_stale_handle():
+    handles = mem.add_many([1, 2])
+    mem.free(handles[0])
+    var = mem.add(100)
+    for action in [mem.free, mem.read, lambda h: mem.modify(h, 5),
+                   lambda h: mem.filter(h, lambda x: True)]:
+        try:
+            action(handles[0])
+            assert False, 'The handle is freed'
+        except ValueError:
+            pass
+    mem.map(handles[0], lambda x: x + 1)
+    assert mem.read(var) == 100
+    assert all(v >= 0 for v in mem.slaves_tracking.values())
+
+    mem.filter(handles[1], lambda x: False)
+    try:
+        mem.read(handles[1])
+        assert False, 'The handle is filtered out'
+    except ValueError:
+        pass
+    mem.free(var)
+    assert all(v == 0 for v in mem.slaves_tracking.values())
+
+
+@test
+def test_slab_big_int():
+    var = mem.add(2 ** 70)
+    assert mem.read(var) == 2 ** 70
+    mem.map(var, lambda x: x // 2 ** 60)
+    assert mem.read(var) == 2 ** 10
+    mem.map(var, lambda x: x ** 10)
+    assert mem.read(var) == 2 ** 100
+    mem.free(var)
+
+
+@test
+def test_variable_slots():
+    var = mem.add(42)
+    assert not hasattr(var, '__dict__')
+    assert var.replicas is None
+    mem.free(var)
+
+
+@test
+def test_topk():
+    original = list(range(15))
+    random.shuffle(original)
+    var = mem.add(original)
+    assert mem.topk(var, 4) == [14, 13, 12, 11]
+    assert mem.topk(var, 20) == sorted(original, reverse=True)
+    mem.free(var)
+
+
+@test
+def test_quantiles():
+    original = list(range(15))
+    random.shuffle(original)
+    var = mem.add(original)
+    assert mem.quantiles(var, [0, 0.5, 1]) == [0, 7, 14]
+    quantiles = mem.quantiles(var, [0, 0.25, 0.75, 1], resolution=3)
+    assert quantiles[0] == 0 and quantiles[-1] == 14
+    assert 0 <= quantiles[1] <= quantiles[2] <= 14
+    mem.free(var)
+    # Nearest rank: the smallest value with at least q * n values up to it.
+    for values, expected in [([4, 1, 3, 2], [1, 2, 3]),
+                             ([6, 5, 4, 3, 2, 1], [2, 3, 5])]:
+        var = mem.add(values)
+        assert mem.quantiles(var, [0.25, 0.5, 0.75]) == expected
+        mem.free(var)
+
+
+@test
+def test_histogram():
+    var = mem.add([1, 2, 2, 3, 4, 9, 9, 10, 12, 0, 5, 6, 7, 8, 11])
+    counts, edges = mem.histogram(var, [0, 2, 4, 13])
+    assert counts == [2, 3, 10]
+    assert edges == [0, 2, 4, 13]
+    counts, edges = mem.histogram(var, 4)
+    assert counts == [4, 3, 3, 5]
+    assert edges == [0, 3, 6, 9, 12]
+    mem.free(var)
+
+
+@test
+def test_usage():
+    var = mem.add([1, 2, 3])
+    slave_id = dm.collector.Collector.get_slave_id(var.var_names[0])
+    report = mem.usage()[slave_id]
+    assert report['elements'] == mem.slaves_tracking[slave_id]
+    assert report['chunks'][var.var_names[0]] >= dm.collector.footprint([1, 2, 3])
+    assert report['total'] >= report['chunks'][var.var_names[0]]
+    before = report['chunks'][var.var_names[0]]
+    mem.map(var, lambda x: x + 2 ** 40)
+    after = mem.usage()[slave_id]['chunks'][var.var_names[0]]
+    assert after - before == 3 * (sys.getsizeof(2 ** 40) - sys.getsizeof(1))
+    mem.modify(var, 2 ** 70, index=0)
+    assert mem.usage()[slave_id]['chunks'][var.var_names[0]] - after ==\
+        sys.getsizeof(2 ** 70) - sys.getsizeof(2 ** 40)
+    before = mem.usage()[slave_id]['total']
+    mem.free(var)
+    assert mem.usage()[slave_id]['total'] < before
+    # Without budget, the Master does not track the bytes.
+    assert not any(mem.bytes_tracking.values())
+
+
+@test
+def test_bytes_budget():
+    totals = [report['total'] for report in mem.usage().values()]
+    mem.max_per_slave = None
+    mem.max_bytes_per_slave = max(totals) + 1000
+    mem.usage()
+    try:
+        var = mem.add([1, 2, 3])
+        try:
+            size = mem.nb_slaves * mem.max_bytes_per_slave // 32
+            mem.add(list(range(2 ** 40, 2 ** 40 + size)))
+            assert False, 'The bytes budget is exceeded'
+        except Exception as e:
+            assert 'Not enough memory' in str(e)
+        mem.map(var, lambda x: x + 2 ** 40)
+        var_int = mem.add(2)
+        assert not mem.stale_slaves
+        mem.free(var_int)
+        mem.free(var)
+    finally:
+        mem.max_per_slave = 10
+        mem.max_bytes_per_slave = None
+        mem.bytes_tracking.clear()
+
+
+@test
+def test_bytes_budget_dict():
+    totals = [report['total'] for report in mem.usage().values()]
+    mem.max_per_slave = None
+    mem.max_bytes_per_slave = max(totals) + 2000
+    mem.usage()
+    try:
+        d = mem.add_dict({'a': 1})
+        try:
+            mem.dict_put(d, 'b', list(range(2 ** 40, 2 ** 40 + 100)))
+            assert False, 'The bytes budget is exceeded'
+        except Exception as e:
+            assert 'Not enough memory' in str(e)
+        assert mem.dict_read(d) == {'a': 1}
+        mem.dict_free(d)
+
+        var = mem.add(list(range(40)))
+        d = mem.count_by(var, lambda x: x % 2)
+        assert mem.dict_read(d) == {0: 20, 1: 20}
+        mem.dict_free(d)
+        try:
+            mem.group_by(var, lambda x: x)
+            assert False, 'The bytes budget is exceeded'
+        except Exception as e:
+            assert 'Not enough memory' in str(e)
+        assert all(not r['dicts'] for r in mem.usage().values())
+        mem.free(var)
+    finally:
+        mem.max_per_slave = 10
+        mem.max_bytes_per_slave = None
+        mem.bytes_tracking.clear()
+
 def main():
     test_add_int()
     test_add_list_small()
@@ -199,9 +724,44 @@ def main():
     test_filter_big_list()
     test_filter_free_small()
     test_filter_free_big()
+    test_save_load_int()
+    test_save_load_big_list()
+    test_save_after_filter()
+    test_save_big_int()
+    test_load_bad_size()
+    test_replication_add_free()
+    test_replication_capacity()
+    test_replication_reads_spread()
+    test_replication_writes()
+    test_replication_refused()
+    test_replication_int()
+    test_serializer_pack_unpack()
+    test_serializer_delta()
+    test_serializer_small_values()
+    test_serializer_compress_fun()
+    test_dict_put_get()
+    test_dict_many()
+    test_count_by()
+    test_group_by()
+    test_group_by_bad_key()
+    test_stats()
+    test_dump_trace()
+    test_add_many()
+    test_slot_reuse()
+    test_stale_handle()
+    test_slab_big_int()
+    test_variable_slots()
+    test_topk()
+    test_quantiles()
+    test_histogram()
+    test_usage()
+    test_bytes_budget()
+    test_bytes_budget_dict()
 
 
 if __name__ == '__main__':
-    mem = dm.init_memory(max_per_slave=10)
+    # The metrics and the trace are only recorded with --metrics.
+    metrics = '--metrics' in sys.argv
+    mem = dm.init_memory(max_per_slave=10, metrics=metrics, trace=metrics)
     main()
     mem.quit()
\ No newline at end of file